@@ -11,6 +11,7 @@ set "ini_file=%current_dir%\config.ini"
 REM 设置默认参数值
 set "WD_MODEL=wd14-large"
 set "WD_THRESHOLD=0.85"
+set "TAGGER_BACKEND=http"
 
 REM 从INI文件读取参数
 if exist "%ini_file%" (
@@ -20,8 +21,14 @@ if exist "%ini_file%" (
     for /f "tokens=1,* delims== " %%a in ('type "%ini_file%" ^| findstr /i /c:"wd_threshold"') do (
         if /i "%%a"=="wd_threshold" set "WD_THRESHOLD=%%b"
     )
+    for /f "tokens=1,* delims== " %%a in ('type "%ini_file%" ^| findstr /i /c:"tagger_backend"') do (
+        if /i "%%a"=="tagger_backend" set "TAGGER_BACKEND=%%b"
+    )
 )
 
+REM 使用本地ONNX模型时不需要启动API服务器
+if /i "%TAGGER_BACKEND%"=="onnx" goto start_controller
+
 REM 启动API服务器窗口
 start "WD14 Tagger API Server" cmd /k "call conda activate "%current_dir%\env" && cd /d "%current_dir%\wd14-tagger-api-server" && python -m wd14_tagger_api -d gpu -wdm %WD_MODEL% -wdt %WD_THRESHOLD%"
 
@@ -30,6 +37,8 @@ REM 等待服务启动
 echo Waiting for API server initialization...
 timeout /t 4 /nobreak >nul
 
+:start_controller
+
 
 REM 启动控制器程序
 start "Tagger Controller" cmd /k "cd /d "%current_dir%" && python controller.py"
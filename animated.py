@@ -0,0 +1,171 @@
+import io
+import os
+import configparser
+
+import framededup
+import metrics
+
+# 可以用Pillow逐帧读取的动图类型；webp在[FindPhoto] image_exts中，作为图片处理，不会走到这里
+ANIMATED_TYPES = ('gif',)
+# 浏览器把0延迟的帧按0.1秒播放
+DEFAULT_DELAY_MS = 100
+# 停留这么久的帧（幻灯片式动图）即使不满min_scene_len也单独成为一个场景
+SLIDE_SECONDS = 1.0
+# 每次向量化计算帧差的帧数，限制缩小帧占用的内存
+CHUNK_FRAMES = 64
+
+
+class UnsupportedAnimation(Exception):
+    """无法用Pillow读取该动图，需要回退到scenedetect"""
+
+
+def load_config():
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+    return {
+        'enabled': config.getboolean('animated', 'enabled', fallback=False),
+        'max_frames': config.getint('animated', 'max_frames', fallback=5000)
+    }
+
+
+def can_handle(video_path, config):
+    ext = os.path.splitext(video_path)[1][1:].lower()
+    return config['animated']['enabled'] and ext in ANIMATED_TYPES
+
+
+def open_animation(video_path, max_frames):
+    try:
+        from PIL import Image
+    except ImportError:
+        raise UnsupportedAnimation("未安装Pillow")
+    try:
+        image = Image.open(video_path)
+        frame_count = getattr(image, 'n_frames', 1)
+    except Exception as e:
+        raise UnsupportedAnimation(f"Pillow无法读取动图: {video_path}: {str(e)}")
+    if image.format != 'GIF':
+        image.close()
+        raise UnsupportedAnimation(f"不是GIF动图: {video_path}")
+    if frame_count > max_frames:
+        image.close()
+        raise UnsupportedAnimation(f"动图帧数过多（{frame_count}帧）: {video_path}")
+    return image, frame_count
+
+
+def compute_scores(image, frame_count, analysis_width=256):
+    """逐帧读取延迟并在缩小的HSV帧上向量化计算帧间差，返回(分数数组, 各帧起始秒数, 总秒数)
+
+    分数与detect-content一致，为HSV三个通道平均差的均值，分数[0]恒为0。
+    """
+    import cv2
+    import numpy as np
+    from PIL import Image
+
+    width, height = image.size
+    scale = analysis_width / width if 0 < analysis_width < width else 1
+    small_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+    scores = [np.zeros(1, dtype=np.float32)]
+    delays = []
+    chunk = []
+    prev = None
+    for index in range(frame_count):
+        image.seek(index)
+        delays.append(image.info.get('duration') or DEFAULT_DELAY_MS)
+        # 调色板帧先用最近邻缩小再查表转换，不展开整帧
+        frame = image.resize(small_size, Image.NEAREST) if scale < 1 else image
+        chunk.append(cv2.cvtColor(np.asarray(frame.convert('RGB')), cv2.COLOR_RGB2HSV))
+        if len(chunk) == CHUNK_FRAMES or index == frame_count - 1:
+            stack = np.stack(chunk if prev is None else [prev] + chunk).astype(np.int16)
+            delta = np.abs(np.diff(stack, axis=0)).sum(axis=(1, 2, 3), dtype=np.int64)
+            scores.append((delta / stack[0].size).astype(np.float32))
+            prev = chunk[-1]
+            chunk = []
+
+    starts = np.concatenate(([0.0], np.cumsum(delays, dtype=np.float64)[:-1])) / 1000.0
+    return np.concatenate(scores)[:frame_count], starts, sum(delays) / 1000.0
+
+
+def find_scenes(scores, starts, threshold, min_scene_len):
+    """按帧差切分场景，返回[(起始帧, 结束帧)]，结束帧不包含"""
+    import numpy as np
+    cuts = [0]
+    for frame_num in np.flatnonzero(scores >= threshold):
+        frame_num = int(frame_num)
+        if frame_num == 0:
+            continue
+        # 上一场景满min_scene_len帧，或已停留足够久（幻灯片）时才切分
+        if frame_num - cuts[-1] >= min_scene_len or starts[frame_num] - starts[cuts[-1]] >= SLIDE_SECONDS:
+            cuts.append(frame_num)
+    bounds = cuts + [len(scores)]
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+
+def representative_frames(scenes, starts, total):
+    """每个场景取播放时间上位于场景中点的帧"""
+    import numpy as np
+    ends = np.append(starts[1:], total)
+    picks = []
+    for start, end in scenes:
+        middle = (starts[start] + ends[end - 1]) / 2
+        picks.append(start + int(np.searchsorted(starts[start:end], middle, side='right')) - 1)
+    return picks
+
+
+def extract_keyframes(video_path, config):
+    """在本进程内读取动图，返回[(文件名, RGB图片)]，无法处理时抛出UnsupportedAnimation"""
+    import numpy as np
+
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    image, frame_count = open_animation(video_path, config['animated']['max_frames'])
+    try:
+        with metrics.timer('scene_detection'):
+            try:
+                scores, starts, total = compute_scores(image, frame_count, config['analysis_width'])
+            except (OSError, ValueError, EOFError) as e:
+                raise UnsupportedAnimation(f"动图解码失败: {video_path}: {str(e)}")
+            scenes = find_scenes(scores, starts, config['threshold'], config['min_scene_len'])
+        metrics.count('decoded_frames', frame_count)
+        metrics.count('decoded_pixels', frame_count * image.size[0] * image.size[1])
+        metrics.count('animated_images')
+
+        with metrics.timer('frame_extraction'):
+            keyframes = []
+            for scene_num, frame_num in enumerate(representative_frames(scenes, starts, total), 1):
+                image.seek(frame_num)
+                frame = image.convert('RGB')
+                frame.thumbnail((config['max_image_size'], config['max_image_size']))
+                keyframes.append((f"{stem}-Scene-{scene_num:03d}-01.jpg", frame))
+
+            dedup = config.get('dedup')
+            if dedup and dedup['enabled']:
+                # RGB与BGR只影响转灰度时的通道权重，不影响去重判断
+                arrays = [np.asarray(frame) for _, frame in keyframes]
+                kept = framededup.select_frames(arrays, total, dedup)
+                keyframes = [keyframes[i] for i in kept]
+    finally:
+        image.close()
+    metrics.count('keyframes', len(keyframes))
+    return keyframes
+
+
+def encode_keyframes(video_path, config):
+    """把动图的代表帧编码为内存中的JPEG，返回[(文件名, JPEG字节)]"""
+    encoded = []
+    keyframes = extract_keyframes(video_path, config)
+    with metrics.timer('frame_extraction'):
+        for name, frame in keyframes:
+            buffer = io.BytesIO()
+            frame.save(buffer, 'JPEG', quality=95)
+            encoded.append((name, buffer.getvalue()))
+    return encoded
+
+
+def save_keyframes(video_path, config):
+    """把动图的代表帧写入所在目录，返回写入的文件数"""
+    video_dir = os.path.dirname(video_path)
+    frames = encode_keyframes(video_path, config)
+    for name, data in frames:
+        with open(os.path.join(video_dir, name), 'wb') as f:
+            f.write(data)
+    return len(frames)
\ No newline at end of file
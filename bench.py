@@ -0,0 +1,435 @@
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import random
+import struct
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import configparser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 合成素材库中使用的标签（均在Tags-zh.csv中，tag.py会正常翻译）
+FAKE_TAGS = [
+    '1girl', '1boy', 'solo', 'long_hair', 'short_hair', 'smile', 'looking_at_viewer', 'blush', 'open_mouth',
+    'outdoors', 'indoors', 'sky', 'day', 'night', 'tree', 'water', 'dress', 'shirt', 'skirt', 'hat'
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="在合成素材库和本地假标注服务上测量标注流程的吞吐量")
+    parser.add_argument('--images', type=int, default=200, help="合成图片条目数")
+    parser.add_argument('--videos', type=int, default=10, help="合成视频条目数（需要opencv）")
+    parser.add_argument('--image-size', type=int, default=1024, help="合成图片的最长边（像素）")
+    parser.add_argument('--video-seconds', type=float, default=10, help="合成视频时长（秒）")
+    parser.add_argument('--latency-ms', type=float, default=50, help="假标注服务每次请求的平均延迟")
+    parser.add_argument('--jitter-ms', type=float, default=10, help="假标注服务延迟的随机波动")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="假标注服务返回503的比例")
+    parser.add_argument('--mode', choices=['pipeline', 'subprocess', 'both'], default='pipeline')
+    parser.add_argument('--repeat', type=int, default=1, help="重复次数，报告取中位数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help="工作目录（默认使用临时目录，结束后删除）")
+    parser.add_argument('--output', help="报告JSON的保存路径")
+    parser.add_argument('--compare', help="与之前保存的报告对比，变慢超过--tolerance时返回非0")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="允许的相对变慢比例")
+    return parser.parse_args()
+
+
+class FakeTagger:
+    """本地替代/tag-image/的假标注服务，可设置延迟和出错比例"""
+
+    def __init__(self, latency_ms=50, jitter_ms=10, error_rate=0.0, seed=0):
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/tag-image/"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        tagger = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # 小响应立即发出，不等待客户端的延迟ACK
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with tagger.lock:
+                    tagger.requests += 1
+                    delay = max(0.0, tagger.latency + tagger.random.uniform(-tagger.jitter, tagger.jitter))
+                    failed = tagger.random.random() < tagger.error_rate
+                    if failed:
+                        tagger.errors += 1
+                time.sleep(delay)
+                if failed:
+                    self._reply(503, b'{"detail": "overloaded"}')
+                    return
+                # 同一张图总是得到相同的标签
+                rng = random.Random(zlib.crc32(body))
+                tags = rng.sample(FAKE_TAGS, rng.randint(3, 8))
+                self._reply(200, json.dumps(', '.join(tags)).encode('utf-8'))
+
+            def do_GET(self):
+                self._reply(200, b'{}')
+
+            def _reply(self, status, data):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                # 已关闭Nagle算法，响应体分开写出也不会等待延迟ACK
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def png_bytes(width, height, rows):
+    """不依赖第三方库写出RGB PNG，rows为每行的RGB字节"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    raw = b''.join(b'\x00' + row for row in rows)
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        + chunk(b'IDAT', zlib.compress(raw, 6))
+        + chunk(b'IEND', b'')
+    )
+
+
+def write_image(path, size, rng):
+    """渐变背景加随机色块，避免所有图片内容相同或完全不可压缩"""
+    width, height = size, max(1, size * 3 // 4)
+    base = [rng.randrange(256) for _ in range(3)]
+    blocks = [(rng.randrange(width), rng.randrange(height), rng.randrange(width // 4 + 1),
+               bytes(rng.randrange(256) for _ in range(3))) for _ in range(6)]
+    rows = []
+    for y in range(height):
+        shade = y * 255 // height
+        row = bytearray(bytes(((c + shade) % 256 for c in base)) * width)
+        for bx, by, bs, color in blocks:
+            if by <= y < by + bs:
+                end = min(width, bx + bs)
+                row[bx * 3:end * 3] = color * (end - bx)
+        rows.append(bytes(row))
+    with open(path, 'wb') as f:
+        f.write(png_bytes(width, height, rows))
+    return width, height
+
+
+def write_video(path, seconds, rng, fps=24):
+    """生成带若干场景切换的短视频，每个场景内有移动的色块"""
+    import cv2
+    import numpy as np
+    width, height = 320, 240
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    total = max(1, int(seconds * fps))
+    cut = 0
+    color = None
+    try:
+        for i in range(total):
+            if i >= cut:
+                color = [rng.randrange(256) for _ in range(3)]
+                cut = i + rng.randint(fps, fps * 4)
+            frame = np.full((height, width, 3), color, dtype=np.uint8)
+            x = (i * 7) % (width - 40)
+            frame[100:140, x:x + 40] = 255 - np.array(color, dtype=np.uint8)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return width, height
+
+
+def make_library(root, images, videos, image_size, video_seconds, seed=0):
+    """在root/images下生成Eagle格式的条目文件夹，返回实际生成的(图片数, 视频数)"""
+    rng = random.Random(seed)
+    image_dir = os.path.join(root, 'images')
+    os.makedirs(image_dir, exist_ok=True)
+    if videos:
+        try:
+            import cv2  # noqa: F401
+        except ImportError:
+            print("未安装opencv，跳过合成视频")
+            videos = 0
+
+    now = int(time.time() * 1000)
+    for i in range(images + videos):
+        item_id = f"BENCH{seed:02d}{i:06d}"
+        folder = os.path.join(image_dir, f"{item_id}.info")
+        os.makedirs(folder, exist_ok=True)
+        name = f"素材{i:05d}"
+        if i < images:
+            ext = 'png'
+            width, height = write_image(os.path.join(folder, f"{name}.{ext}"), image_size, rng)
+        else:
+            ext = 'mp4'
+            # Windows上VideoWriter不支持含中文的文件名，先写临时文件再改名
+            tmp_path = os.path.join(folder, 'bench.tmp.mp4')
+            width, height = write_video(tmp_path, video_seconds, rng)
+            os.replace(tmp_path, os.path.join(folder, f"{name}.{ext}"))
+        metadata = {
+            'id': item_id,
+            'name': name,
+            'size': os.path.getsize(os.path.join(folder, f"{name}.{ext}")),
+            'btime': now,
+            'mtime': now,
+            'ext': ext,
+            'tags': [],
+            'folders': [],
+            'isDeleted': False,
+            'url': '',
+            'annotation': '',
+            'modificationTime': now,
+            'width': width,
+            'height': height
+        }
+        with open(os.path.join(folder, 'metadata.json'), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False)
+    return images, videos
+
+
+def prepare_workdir(workdir, api_url):
+    """复制程序和翻译表到工作目录并写入指向合成素材库和假标注服务的配置"""
+    for name in os.listdir(BASE_DIR):
+        if name.endswith('.py') or name == 'Tags-zh.csv':
+            shutil.copy2(os.path.join(BASE_DIR, name), workdir)
+    config = configparser.ConfigParser()
+    config.read(os.path.join(BASE_DIR, 'config.ini'), encoding='utf-8')
+    library = os.path.join(workdir, 'library', 'images')
+    settings = {
+        'FindPhoto': {'paths': library},
+        'findvideo': {'search_paths': library},
+        'Server': {'api_url': api_url},
+        'WD14-Tagger': {'tagger_backend': 'http'},
+        'Cache': {'enabled': 'false'},
+        'metrics': {'enabled': 'true', 'jsonl_path': 'metrics.jsonl', 'prometheus_dir': ''}
+    }
+    for section, values in settings.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in values.items():
+            config.set(section, key, value)
+    with open(os.path.join(workdir, 'config.ini'), 'w', encoding='utf-8') as f:
+        config.write(f)
+
+
+def run_script(workdir, script, walls):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, f"{script}.py"], check=True, cwd=workdir, stdout=subprocess.DEVNULL)
+    walls[script] = walls.get(script, 0.0) + time.perf_counter() - start
+
+
+def run_subprocess_mode(workdir):
+    """按controller.py的subprocess模式逐个启动脚本，返回各脚本的累计耗时"""
+    walls = {}
+    path_file = os.path.join(workdir, 'path.txt')
+    run_script(workdir, 'findphoto', walls)
+    if os.path.exists(path_file):
+        run_script(workdir, 'processimage', walls)
+        run_script(workdir, 'tag', walls)
+    run_script(workdir, 'findvideo', walls)
+    queue_file = os.path.join(workdir, 'video_queue.txt')
+    if os.path.exists(queue_file):
+        with open(queue_file, 'r', encoding='utf-8') as f:
+            video_queue = [line.strip() for line in f if line.strip()]
+        for video_path in video_queue:
+            with open(path_file, 'w', encoding='utf-8') as f:
+                f.write(video_path + '\n')
+            run_script(workdir, 'processvideo', walls)
+            run_script(workdir, 'processimage', walls)
+            run_script(workdir, 'tag', walls)
+    return walls
+
+
+def run_pipeline_mode(workdir):
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, '-c', 'import pipeline; pipeline.Pipeline().run()'],
+        check=True, cwd=workdir, stdout=subprocess.DEVNULL
+    )
+    return {'pipeline': time.perf_counter() - start}
+
+
+def read_metrics(workdir):
+    """汇总本次运行各脚本写入的metrics.jsonl"""
+    stages = {}
+    counters = {}
+    try:
+        with open(os.path.join(workdir, 'metrics.jsonl'), 'r', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        records = []
+    for record in records:
+        for stage, timing in record['stages'].items():
+            total = stages.setdefault(stage, {'calls': 0, 'seconds': 0.0})
+            total['calls'] += timing['calls']
+            total['seconds'] += timing['seconds']
+        for name, value in record['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+    return stages, counters
+
+
+def count_tagged(library):
+    tagged = 0
+    for folder in os.listdir(library):
+        try:
+            with open(os.path.join(library, folder, 'metadata.json'), 'r', encoding='utf-8') as f:
+                if '已自动标注' in json.load(f).get('tags', []):
+                    tagged += 1
+        except (OSError, ValueError):
+            pass
+    return tagged
+
+
+def run_once(args, mode, run_dir, api_url):
+    os.makedirs(run_dir)
+    prepare_workdir(run_dir, api_url)
+    images, videos = make_library(
+        os.path.join(run_dir, 'library'), args.images, args.videos, args.image_size, args.video_seconds, args.seed
+    )
+    start = time.perf_counter()
+    walls = run_pipeline_mode(run_dir) if mode == 'pipeline' else run_subprocess_mode(run_dir)
+    total = time.perf_counter() - start
+    stages, counters = read_metrics(run_dir)
+    tagged = count_tagged(os.path.join(run_dir, 'library', 'images'))
+    return {
+        'total': total,
+        'items': images + videos,
+        'tagged': tagged,
+        'items_per_second': (images + videos) / total if total else 0,
+        'scripts': walls,
+        'stages': {stage: timing['seconds'] for stage, timing in stages.items()},
+        'counters': counters
+    }
+
+
+def median_run(runs):
+    """各项取多次运行的中位数，计数取第一次运行的值"""
+    def median(values):
+        values = sorted(values)
+        middle = len(values) // 2
+        return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+    result = dict(runs[0])
+    for key in ('total', 'items_per_second'):
+        result[key] = median([run[key] for run in runs])
+    for group in ('scripts', 'stages'):
+        keys = {key for run in runs for key in run[group]}
+        result[group] = {key: median([run[group].get(key, 0.0) for run in runs]) for key in sorted(keys)}
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    for mode, result in report['results'].items():
+        print(f"\n[{mode}] 共{result['items']}项，标注完成{result['tagged']}项，"
+              f"耗时{result['total']:.2f}秒，{result['items_per_second']:.1f}项/秒")
+        for script, seconds in result['scripts'].items():
+            print(f"  {script:<14}{seconds:8.2f}秒")
+        for stage, seconds in result['stages'].items():
+            print(f"  阶段 {stage:<18}{seconds:8.2f}秒（累计）")
+
+
+def compare(report, baseline, tolerance):
+    """逐项对比耗时，返回变慢超过tolerance的项目列表"""
+    regressions = []
+    print(f"\n与基准报告对比（{baseline.get('revision')} -> {report.get('revision')}）：")
+    if baseline.get('params') != report['params']:
+        print("  注意：两次运行的参数不同，结果不能直接比较")
+    for mode, result in report['results'].items():
+        base = baseline['results'].get(mode)
+        if base is None:
+            continue
+        entries = [('total', base['total'], result['total'])]
+        for group in ('scripts', 'stages'):
+            for key, seconds in result[group].items():
+                if key in base[group]:
+                    entries.append((f"{group}.{key}", base[group][key], seconds))
+        for name, old, new in entries:
+            change = (new - old) / old if old > 0 else 0.0
+            flag = ''
+            # 很短的阶段受噪声影响大，不计入
+            if change > tolerance and new - old > 0.05:
+                flag = '  <- 变慢'
+                regressions.append(f"{mode}.{name}")
+            print(f"  [{mode}] {name:<28}{old:8.2f} -> {new:8.2f}秒 ({change:+.0%}){flag}")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix='eagle-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    modes = ['pipeline', 'subprocess'] if args.mode == 'both' else [args.mode]
+    tagger = FakeTagger(args.latency_ms, args.jitter_ms, args.error_rate, args.seed).start()
+    report = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'params': {k: v for k, v in vars(args).items() if k not in ('workdir', 'output', 'compare')},
+        'results': {}
+    }
+    try:
+        for mode in modes:
+            runs = []
+            for i in range(args.repeat):
+                print(f"运行 {mode} 第{i + 1}/{args.repeat}次...")
+                runs.append(run_once(args, mode, os.path.join(workdir, f"{mode}-{i}"), tagger.url))
+            report['results'][mode] = median_run(runs)
+    finally:
+        tagger.stop()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report['fake_tagger'] = {'requests': tagger.requests, 'errors': tagger.errors}
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n报告已保存到 {args.output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n发现{len(regressions)}项性能退化")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -1,12 +1,57 @@
 import os
+import argparse
+import configparser
 import subprocess
 import sys
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Eagle素材库自动标注")
+    parser.add_argument(
+        '--mode', choices=['pipeline', 'subprocess'],
+        help="pipeline: 单进程流水线；subprocess: 每个阶段单独启动子进程（默认读取config.ini）"
+    )
+    parser.add_argument(
+        '--watch', action='store_true',
+        help="监视模式：常驻运行，素材库有新导入时自动标注（使用单进程流水线）"
+    )
+    parser.add_argument(
+        '--time-budget',
+        help="本次运行的时间预算，如 90m、2h、3600（秒）；用完后不再开始新条目，剩余条目下次运行时继续（使用单进程流水线）"
+    )
+    parser.add_argument(
+        '--max-items', type=int,
+        help="本次运行最多处理的条目数，剩余条目下次运行时继续（使用单进程流水线）"
+    )
+    return parser.parse_args()
+
+
+def load_mode():
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+    return config.get('pipeline', 'mode', fallback='subprocess').strip().lower()
+
+
 def main():
+    args = parse_args()
     try:
         # 获取当前脚本所在目录的绝对路径
         base_dir = os.path.dirname(os.path.abspath(__file__))
+        os.chdir(base_dir)
+
+        if args.watch:
+            import watcher
+            watcher.main()
+            return
+
+        limited = args.time_budget is not None or args.max_items is not None
+        if (args.mode or load_mode()) == 'pipeline' or limited:
+            # 单进程流水线模式，配置与翻译表只加载一次
+            import pipeline
+            import scheduler
+            time_budget = scheduler.parse_duration(args.time_budget) if args.time_budget is not None else None
+            pipeline.Pipeline().run(time_budget, args.max_items)
+            return
 
         # 模块1：处理图片
         print("开始处理图片...")
@@ -38,21 +83,27 @@ def main():
 
         # 模块2：循环处理视频
         print("\n开始处理视频...")
-        video_count = 0
-        while True:
-            # 查找视频（强制指定工作目录）
-            subprocess.run(
-                [sys.executable, 'findvideo.py'],
-                check=True,
-                cwd=base_dir
-            )
+        # 一次遍历生成全部待处理视频队列
+        subprocess.run(
+            [sys.executable, 'findvideo.py'],
+            check=True,
+            cwd=base_dir
+        )
 
-            # 使用绝对路径检查文件
-            if not os.path.exists(os.path.join(base_dir, 'path.txt')):
-                print("已无未标注【已自动标注】的视频。")
-                break
+        queue_file = os.path.join(base_dir, 'video_queue.txt')
+        if not os.path.exists(queue_file):
+            print("已无未标注【已自动标注】的视频。")
+            return
+        with open(queue_file, 'r', encoding='utf-8') as f:
+            video_queue = [line.strip() for line in f if line.strip()]
+        print(f"共找到{len(video_queue)}个未标注的视频")
+
+        video_count = 0
+        for video_path in video_queue:
+            # 后续处理仍通过path.txt逐个传递（保持工作目录一致）
+            with open(path_file, 'w', encoding='utf-8') as f:
+                f.write(video_path + '\n')
 
-            # 后续处理（保持工作目录一致）
             subprocess.run(
                 [sys.executable, 'processvideo.py'],
                 check=True,
@@ -73,6 +124,11 @@ def main():
             if video_count % 10 == 0:
                 print(f"已标注{video_count}个视频")
 
+        os.remove(queue_file)
+        if os.path.exists(path_file):
+            os.remove(path_file)
+        print("已无未标注【已自动标注】的视频。")
+
     except subprocess.CalledProcessError as e:
         print(f"\n错误：在执行 {e.cmd} 时发生错误（返回码：{e.returncode}）")
     except Exception as e:
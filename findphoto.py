@@ -1,6 +1,8 @@
 import configparser
 import os
-import json
+
+import libindex
+import metrics
 
 
 def load_config():
@@ -13,45 +15,31 @@ def load_config():
     }
     return params
 
-def process_metadata(filepath, valid_exts):
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            metadata = json.load(f)
-
-        if "已自动标注" not in metadata.get("tags", []):
-            ext = metadata.get("ext", "").lower()
-            if ext in valid_exts:
-                # 记录文件路径
-                img_path = os.path.join(
-                    os.path.dirname(filepath),
-                    f"{metadata['name']}.{metadata['ext']}"
-                )
-                with open('path.txt', 'a', encoding='utf-8') as log:  # 网页2][网页5]
-                    log.write(img_path + '\n')
-
-                # 生成标注提示文件
-                flag_file = os.path.join(
-                    os.path.dirname(filepath),
-                    "待标注为已标注.txt"
-                )
-                with open(flag_file, 'w', encoding='utf-8') as f:
-                    f.write("已自动标注")
-                return True
-    except Exception as e:
-        print(f"处理 {filepath} 时发生错误: {str(e)}")
-    return False
+def find_photos(config):
+    """扫描索引并返回所有未标注图片的路径"""
+    with metrics.timer('discovery'):
+        index = libindex.LibraryIndex(libindex.load_config()['db_path'])
+        try:
+            entries, stats = index.scan(config["paths"], config["image_exts"])
+        finally:
+            index.close()
+    metrics.count('discovered_images', len(entries))
+    print(libindex.format_stats(stats))
+    return [os.path.join(entry.folder, f"{entry.name}.{entry.ext}") for entry in entries]
 
 
 def main():
-    config = load_config()
-    for root_path in config["paths"]:
-        for root, dirs, files in os.walk(root_path):
-            if "metadata.json" in files:
-                metadata_path = os.path.join(root, "metadata.json")
-                process_metadata(metadata_path, config["image_exts"])
+    img_paths = find_photos(load_config())
+    if not img_paths:
+        return
+    # 记录文件路径
+    with open('path.txt', 'a', encoding='utf-8') as log:  # 网页2][网页5]
+        for img_path in img_paths:
+            log.write(img_path + '\n')
 
 
 if __name__ == "__main__":
     if os.path.exists("path.txt"):
         os.remove("path.txt")
-    main()
\ No newline at end of file
+    main()
+    metrics.write('findphoto')
\ No newline at end of file
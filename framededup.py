@@ -0,0 +1,133 @@
+import math
+import threading
+import configparser
+
+stats_lock = threading.Lock()
+STATS = {'frames': 0, 'kept': 0, 'duplicates': 0, 'over_budget': 0}
+
+
+def load_config():
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+    return {
+        'enabled': config.getboolean('dedup', 'enabled', fallback=False),
+        'max_distance': config.getint('dedup', 'max_distance', fallback=6),
+        'frames_per_minute': config.getfloat('dedup', 'frames_per_minute', fallback=12),
+        'min_frames': config.getint('dedup', 'min_frames', fallback=3),
+        'max_frames': config.getint('dedup', 'max_frames', fallback=60)
+    }
+
+
+def dhash(frames, hash_size=8):
+    """批量计算差异哈希，frames为BGR或灰度帧列表，返回(N, hash_size*hash_size/8)的uint8数组"""
+    import cv2
+    import numpy as np
+    small = np.empty((len(frames), hash_size, hash_size + 1), dtype=np.int16)
+    for i, frame in enumerate(frames):
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        small[i] = cv2.resize(frame, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = small[:, :, 1:] > small[:, :, :-1]
+    return np.packbits(bits.reshape(len(frames), -1), axis=1)
+
+
+def hamming(hash_value, hashes):
+    """一个哈希与一组哈希之间的汉明距离"""
+    import numpy as np
+    return np.unpackbits(np.bitwise_xor(hashes, hash_value), axis=1).sum(axis=1)
+
+
+def frame_budget(duration, config):
+    """按视频时长计算最多保留的帧数"""
+    budget = math.ceil(config['frames_per_minute'] * duration / 60.0)
+    return max(config['min_frames'], min(config['max_frames'], budget))
+
+
+def select_frames(frames, duration, config):
+    """去除近似重复帧并按时长限制帧数，返回保留帧的下标列表（保持原顺序）"""
+    if len(frames) == 0:
+        return []
+    return select_hashes(dhash(frames), duration, config)
+
+
+def select_hashes(hashes, duration, config):
+    """与select_frames相同，输入为已计算好的dhash数组，调用方不必同时持有全部帧"""
+    import numpy as np
+    count = len(hashes)
+    if count == 0:
+        return []
+
+    kept = [0]
+    for i in range(1, count):
+        if hamming(hashes[i], hashes[kept]).min() > config['max_distance']:
+            kept.append(i)
+    duplicates = count - len(kept)
+
+    budget = frame_budget(duration, config) if duration else len(kept)
+    over_budget = 0
+    if len(kept) > budget:
+        # 在时间轴上均匀取帧
+        picks = np.linspace(0, len(kept) - 1, budget).round().astype(int)
+        over_budget = len(kept) - len(set(picks.tolist()))
+        kept = [kept[i] for i in sorted(set(picks.tolist()))]
+
+    with stats_lock:
+        STATS['frames'] += count
+        STATS['kept'] += len(kept)
+        STATS['duplicates'] += duplicates
+        STATS['over_budget'] += over_budget
+    return kept
+
+
+def prune_scene_files(directory, video_path, config):
+    """对scenedetect命令行写入磁盘的关键帧去重，返回不需要上传的文件集合"""
+    import cv2
+    import numpy as np
+    import libindex
+    files = sorted(p for p in directory.iterdir() if p.is_file() and '-Scene-' in p.name)
+    frames = []
+    readable = []
+    for path in files:
+        # 用imdecode读取，兼容含中文的路径
+        frame = cv2.imdecode(np.fromfile(str(path), dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if frame is not None:
+            frames.append(frame)
+            readable.append(path)
+
+    info = libindex.probe_video(video_path)
+    if info is not None and info.duration > 0:
+        duration = info.duration
+    else:
+        cap = cv2.VideoCapture(str(video_path))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        cap.release()
+        duration = frame_count / fps if fps > 0 and frame_count > 0 else 0
+
+    kept = set(select_frames(frames, duration, config))
+    return {path for i, path in enumerate(readable) if i not in kept}
+
+
+def take_stats():
+    """取出并清零当前进程的统计，用于从场景检测子进程汇总"""
+    with stats_lock:
+        delta = dict(STATS)
+        for key in STATS:
+            STATS[key] = 0
+    return delta
+
+
+def add_stats(delta):
+    with stats_lock:
+        for key, value in delta.items():
+            STATS[key] += value
+
+
+def format_stats():
+    with stats_lock:
+        saved = STATS['frames'] - STATS['kept']
+        return (
+            f"关键帧去重：共{STATS['frames']}帧，保留{STATS['kept']}帧，"
+            f"去除近似重复{STATS['duplicates']}帧、超出预算{STATS['over_budget']}帧，"
+            f"节省{saved}次标注请求"
+        )
\ No newline at end of file
@@ -0,0 +1,112 @@
+import os
+import threading
+import configparser
+
+stats_lock = threading.Lock()
+STATS = {'files': 0, 'resized': 0, 'passthrough': 0, 'original_bytes': 0, 'upload_bytes': 0}
+
+ENCODINGS = {
+    'jpeg': ('.jpg', 'image/jpeg'),
+    'webp': ('.webp', 'image/webp'),
+    'png': ('.png', 'image/png')
+}
+
+
+def load_config():
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+    image_format = config.get('preprocess', 'format', fallback='jpeg').strip().lower()
+    return {
+        'enabled': config.getboolean('preprocess', 'enabled', fallback=False),
+        'workers': config.getint('preprocess', 'workers', fallback=2),
+        'max_edge': max(448, config.getint('preprocess', 'max_edge', fallback=768)),
+        'format': image_format if image_format in ENCODINGS else 'jpeg',
+        'quality': config.getint('preprocess', 'quality', fallback=90),
+        'min_bytes': config.getint('preprocess', 'min_bytes', fallback=256 * 1024)
+    }
+
+
+def is_animated(head, ext):
+    """根据文件头判断是否为动图（GIF、动态PNG、动态WebP），动图原样上传由服务端处理"""
+    if ext == 'gif':
+        return True
+    if head[:8] == b'\x89PNG\r\n\x1a\n':
+        # acTL块出现在第一个IDAT之前
+        idat = head.find(b'IDAT')
+        actl = head.find(b'acTL')
+        return actl != -1 and (idat == -1 or actl < idat)
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP' and head[12:16] == b'VP8X':
+        return bool(head[20] & 0x02)
+    return False
+
+
+def flatten_alpha(image):
+    """把透明通道合成到白色背景上，与WD14模型的预处理一致"""
+    import numpy as np
+    alpha = image[:, :, 3:4].astype(np.float32) / 255.0
+    color = image[:, :, :3].astype(np.float32)
+    return (color * alpha + 255.0 * (1.0 - alpha)).round().astype(np.uint8)
+
+
+def shrink(file_path, config):
+    """在进程池中运行：解码、缩小到max_edge并重新编码
+
+    返回(上传用的字节, 文件名, MIME类型, 原文件大小)，不需要或无法处理时字节为None，调用方改为上传原文件。
+    """
+    size = os.path.getsize(file_path)
+    ext = os.path.splitext(file_path)[1][1:].lower()
+    with open(file_path, 'rb') as f:
+        head = f.read(64 * 1024)
+    if is_animated(head, ext):
+        return None, None, None, size
+
+    import cv2
+    import numpy as np
+    image = cv2.imdecode(np.fromfile(file_path, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        return None, None, None, size
+    height, width = image.shape[:2]
+    if max(height, width) <= config['max_edge'] and size <= config['min_bytes']:
+        return None, None, None, size
+
+    if image.dtype != np.uint8:
+        # 16位PNG等
+        image = (image / 257).astype(np.uint8) if image.dtype == np.uint16 else cv2.convertScaleAbs(image)
+    if image.ndim == 3 and image.shape[2] == 4:
+        image = flatten_alpha(image)
+    scale = config['max_edge'] / max(height, width)
+    if scale < 1:
+        image = cv2.resize(
+            image, (max(1, round(width * scale)), max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA
+        )
+
+    suffix, mime_type = ENCODINGS[config['format']]
+    if config['format'] == 'jpeg':
+        params = [cv2.IMWRITE_JPEG_QUALITY, config['quality']]
+    elif config['format'] == 'webp':
+        params = [cv2.IMWRITE_WEBP_QUALITY, config['quality']]
+    else:
+        params = []
+    ok, encoded = cv2.imencode(suffix, image, params)
+    if not ok or len(encoded) >= size:
+        return None, None, None, size
+    name = os.path.splitext(os.path.basename(file_path))[0] + suffix
+    return encoded.tobytes(), name, mime_type, size
+
+
+def add_stats(original_bytes, upload_bytes, resized):
+    with stats_lock:
+        STATS['files'] += 1
+        STATS['resized' if resized else 'passthrough'] += 1
+        STATS['original_bytes'] += original_bytes
+        STATS['upload_bytes'] += upload_bytes
+
+
+def format_stats():
+    with stats_lock:
+        saved = STATS['original_bytes'] - STATS['upload_bytes']
+        return (
+            f"上传前缩小：共{STATS['files']}个文件，缩小{STATS['resized']}个、原样上传{STATS['passthrough']}个，"
+            f"上传{STATS['upload_bytes'] / 1024 / 1024:.1f}MB，节省{saved / 1024 / 1024:.1f}MB"
+        )
\ No newline at end of file
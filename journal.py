@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import threading
+
+# 条目状态，按处理顺序排列
+DISCOVERED = 'discovered'
+FRAMES = 'frames'
+TAGGED = 'tagged'
+WRITTEN = 'written'
+FAILED = 'failed'
+FINISHED = (WRITTEN, FAILED)
+# 追加这么多条记录（且超过保留记录数的两倍）后压缩日志，监视模式长期运行时日志不会无限增长
+COMPACT_RECORDS = 10000
+
+
+class Journal:
+    """只追加的任务日志，每行一个JSON记录一个条目的状态变化
+
+    中断后重新启动时回放日志，未完成的条目从最后记录的状态继续，不需要重新扫描素材库。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+        # 日志中的行数和上次压缩后保留的行数
+        self.lines = 0
+        self.kept = 0
+
+    def replay(self):
+        """回放日志，返回{路径: 合并后的最新记录}"""
+        items = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 崩溃时最后一行可能只写了一半
+                        continue
+                    items.setdefault(record['path'], {}).update(record)
+        except FileNotFoundError:
+            pass
+        return items
+
+    def pending(self):
+        """上次运行中未完成的条目记录列表"""
+        return [record for record in self.replay().values() if record['state'] not in FINISHED]
+
+    def open(self, fresh, keep=()):
+        """fresh为True时清空旧日志开始新的一轮（保留keep中的记录），否则在旧日志后继续追加"""
+        with self.lock:
+            if fresh:
+                keep = list(keep)
+                self.lines = self.kept = len(keep)
+            else:
+                try:
+                    with open(self.path, 'rb') as f:
+                        self.lines = sum(1 for _ in f)
+                except FileNotFoundError:
+                    self.lines = 0
+            self.file = open(self.path, 'w' if fresh else 'a', encoding='utf-8')
+            if fresh:
+                for record in keep:
+                    self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+                self.file.flush()
+
+    def record(self, path, state, **fields):
+        entry = {'path': str(path), 'state': state, 'time': time.time()}
+        entry.update(fields)
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            self.lines += 1
+            if self.lines >= max(COMPACT_RECORDS, self.kept * 2):
+                self._compact()
+
+    def _compact(self):
+        """把日志重写为每个未完成或已放弃的条目一行合并后的记录（调用时需持有self.lock）"""
+        self.file.close()
+        records = [record for record in self.replay().values()
+                   if record['state'] not in FINISHED or record.get('given_up')]
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.lines = self.kept = len(records)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.file = None
\ No newline at end of file
@@ -0,0 +1,198 @@
+import os
+import json
+import sqlite3
+import threading
+import configparser
+from collections import namedtuple
+
+import probe
+
+# 已处理条目的标记标签
+TAGGED_MARK = "已自动标注"
+
+IndexEntry = namedtuple('IndexEntry', ['folder', 'name', 'ext', 'tagged'])
+
+INDEX = None
+INDEX_PID = None
+index_lock = threading.Lock()
+
+
+def load_config():
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+    return {
+        'db_path': config.get('Index', 'db_path', fallback='library_index.db')
+    }
+
+
+class LibraryIndex:
+    """Eagle素材库的持久化增量索引
+
+    以条目文件夹为键记录metadata.json的mtime/size、扩展名和标注状态，
+    再次扫描时只对未变化的metadata.json做一次stat，变化的才重新解析。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            " folder TEXT PRIMARY KEY,"
+            " root TEXT NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " name TEXT NOT NULL,"
+            " ext TEXT NOT NULL,"
+            " tagged INTEGER NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS items_root ON items(root)")
+        # 视频容器头信息，文件未变化时不用重新探测；无法识别的文件记为宽高0，也不再重复探测
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS probes ("
+            " path TEXT PRIMARY KEY,"
+            " mtime_ns INTEGER NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " width INTEGER NOT NULL,"
+            " height INTEGER NOT NULL,"
+            " duration REAL NOT NULL,"
+            " fps REAL NOT NULL,"
+            " frame_count INTEGER NOT NULL)"
+        )
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def probe(self, media_path):
+        """返回视频的probe.VideoInfo，无法从文件头识别时返回None"""
+        media_path = os.path.abspath(str(media_path))
+        st = os.stat(media_path)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT mtime_ns, size, width, height, duration, fps, frame_count FROM probes WHERE path = ?",
+                (media_path,)
+            ).fetchone()
+        if row is not None and row[0] == st.st_mtime_ns and row[1] == st.st_size:
+            return probe.VideoInfo(*row[2:]) if row[2] else None
+        info = probe.probe(media_path)
+        values = info or probe.VideoInfo(0, 0, 0.0, 0.0, 0)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO probes (path, mtime_ns, size, width, height, duration, fps, frame_count)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (media_path, st.st_mtime_ns, st.st_size) + tuple(values)
+            )
+        return info
+
+    def _load_root(self, root):
+        rows = self.conn.execute(
+            "SELECT folder, mtime_ns, size, name, ext, tagged FROM items WHERE root = ?",
+            (root,)
+        )
+        return {row[0]: row[1:] for row in rows}
+
+    def scan(self, roots, exts, changed=None):
+        """增量扫描素材库，返回(未标注且扩展名匹配的条目列表, 统计信息)
+
+        传入集合changed时，把本次新增或metadata.json有变化的文件夹加入其中。
+        """
+        valid_exts = {ext.strip().lower() for ext in exts}
+        stats = {'items': 0, 'skipped': 0, 'reread': 0, 'removed': 0, 'errors': 0}
+        pending = []
+
+        with self.lock:
+            for root_path in roots:
+                if not root_path:
+                    continue
+                known = self._load_root(root_path)
+                seen = set()
+                updates = []
+
+                for root, dirs, files in os.walk(root_path):
+                    if "metadata.json" not in files:
+                        continue
+                    metadata_path = os.path.join(root, "metadata.json")
+                    try:
+                        st = os.stat(metadata_path)
+                    except OSError as e:
+                        print(f"处理 {metadata_path} 时发生错误: {str(e)}")
+                        stats['errors'] += 1
+                        continue
+
+                    seen.add(root)
+                    stats['items'] += 1
+                    row = known.get(root)
+                    if row is not None and row[0] == st.st_mtime_ns and row[1] == st.st_size:
+                        stats['skipped'] += 1
+                        name, ext, tagged = row[2], row[3], bool(row[4])
+                    else:
+                        entry = read_metadata(metadata_path)
+                        if entry is None:
+                            stats['errors'] += 1
+                            seen.discard(root)
+                            continue
+                        stats['reread'] += 1
+                        name, ext, tagged = entry
+                        updates.append((root, root_path, st.st_mtime_ns, st.st_size, name, ext, int(tagged)))
+                        if changed is not None:
+                            changed.add(root)
+
+                    if not tagged and ext.lower() in valid_exts:
+                        pending.append(IndexEntry(root, name, ext, tagged))
+
+                removed = [(folder,) for folder in known if folder not in seen]
+                stats['removed'] += len(removed)
+                with self.conn:
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO items (folder, root, mtime_ns, size, name, ext, tagged)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        updates
+                    )
+                    self.conn.executemany("DELETE FROM items WHERE folder = ?", removed)
+
+        return pending, stats
+
+
+def get_index():
+    """获取本进程共享的索引连接（fork出的子进程不能沿用父进程的SQLite连接）"""
+    global INDEX, INDEX_PID
+    with index_lock:
+        if INDEX is None or INDEX_PID != os.getpid():
+            INDEX = LibraryIndex(load_config()['db_path'])
+            INDEX_PID = os.getpid()
+    return INDEX
+
+
+def probe_video(media_path):
+    """带缓存的视频探测，返回probe.VideoInfo，无法识别时返回None"""
+    try:
+        return get_index().probe(media_path)
+    except sqlite3.Error as e:
+        print(f"读取探测缓存失败: {str(e)}")
+        return probe.probe(media_path)
+
+
+def read_metadata(metadata_path):
+    """解析metadata.json，返回(name, ext, 是否已标注)，失败返回None"""
+    try:
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+        return (
+            metadata['name'],
+            metadata.get('ext', ''),
+            TAGGED_MARK in metadata.get('tags', [])
+        )
+    except (json.JSONDecodeError, KeyError, OSError, UnicodeDecodeError) as e:
+        print(f"处理 {metadata_path} 时发生错误: {str(e)}")
+    return None
+
+
+def format_stats(stats):
+    return (
+        f"索引扫描完成：共{stats['items']}项，跳过未变化{stats['skipped']}项，"
+        f"重新读取{stats['reread']}项，移除{stats['removed']}项，错误{stats['errors']}项"
+    )
\ No newline at end of file
@@ -0,0 +1,138 @@
+import math
+import time
+import threading
+import collections
+import configparser
+
+
+def load_config():
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+    return {
+        'enabled': config.getboolean('limiter', 'enabled', fallback=False),
+        'initial': config.getint('limiter', 'initial', fallback=4),
+        'min_limit': config.getint('limiter', 'min_limit', fallback=1),
+        'max_limit': config.getint('limiter', 'max_limit', fallback=32),
+        'tolerance': config.getfloat('limiter', 'tolerance', fallback=1.5),
+        'backoff': config.getfloat('limiter', 'backoff', fallback=0.7),
+        'base_window': config.getfloat('limiter', 'base_window', fallback=30.0)
+    }
+
+
+class AdaptiveLimiter:
+    """自适应并发限制：延迟平稳时逐步增加同时进行的请求数，延迟上升或出错时按比例减少
+
+    短期延迟均线超过基准延迟的tolerance倍时说明服务端开始排队，按两者之比（延迟梯度）减少上限。
+    基准延迟是时间常数为base_window秒的慢速均线，服务端延迟本身有波动时不会误判；
+    计入基准的样本不超过基准的tolerance倍，排队造成的高延迟不会很快把基准抬高而掩盖排队。
+    """
+
+    def __init__(self, initial=4, min_limit=1, max_limit=32, tolerance=1.5, backoff=0.7, base_window=30.0):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.inflight = 0
+        self.short_rtt = None
+        self.base_rtt = None
+        self.base_time = 0.0
+        self.base_window = max(1.0, base_window)
+        self.last_decrease = 0.0
+        self.decreases = 0
+        self.samples = collections.deque(maxlen=1000)
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """等待可用的并发名额，返回开始时间，请求结束后传给release"""
+        with self.condition:
+            while self.inflight >= int(self.limit):
+                self.condition.wait()
+            self.inflight += 1
+        return time.monotonic()
+
+    def release(self, started, ok=True):
+        """ok为False表示超时、连接失败或服务端过载"""
+        now = time.monotonic()
+        rtt = now - started
+        with self.condition:
+            busy = self.inflight >= int(self.limit)
+            self.inflight -= 1
+            if ok:
+                self.samples.append(rtt)
+                if self.short_rtt is None:
+                    self.short_rtt = rtt
+                else:
+                    self.short_rtt += (rtt - self.short_rtt) * 0.2
+                self._update_base(rtt, now)
+                # 前几个请求含建立连接、模型预热的耗时，不据此判断排队
+                gradient = self.base_rtt * self.tolerance / self.short_rtt if self.short_rtt > 0 else 1.0
+                if len(self.samples) >= 10 and gradient < 1.0:
+                    self._decrease(now, gradient)
+                elif busy:
+                    # 只有上限确实被用满时才增加，每轮约增加1
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            else:
+                self._decrease(now)
+            self.condition.notify_all()
+
+    def _update_base(self, rtt, now):
+        if len(self.samples) <= 10:
+            # 预热阶段用算术平均作为初始基准
+            self.base_rtt = rtt if self.base_rtt is None else self.base_rtt + (rtt - self.base_rtt) / len(self.samples)
+        else:
+            # 按经过的时间而不是样本数衰减，并发高时基准也不会变快
+            alpha = 1.0 - math.exp(-(now - self.base_time) / self.base_window)
+            self.base_rtt += (min(rtt, self.base_rtt * self.tolerance) - self.base_rtt) * alpha
+        self.base_time = now
+
+    def _decrease(self, now, gradient=0.0):
+        # 同一波过载会让许多并发请求同时变慢或失败，一个延迟周期内只减少一次
+        if now - self.last_decrease < (self.short_rtt or 0):
+            return
+        self.last_decrease = now
+        self.decreases += 1
+        # 延迟略超过容忍范围时小幅减少，严重排队或出错时最多减少到backoff倍
+        self.limit = max(self.min_limit, self.limit * max(self.backoff, gradient))
+
+    def stats(self):
+        with self.condition:
+            samples = sorted(self.samples)
+            limit = int(self.limit)
+            inflight = self.inflight
+            decreases = self.decreases
+
+        def percentile(q):
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+        return {
+            'limit': limit,
+            'inflight': inflight,
+            'decreases': decreases,
+            'p50': percentile(0.5),
+            'p99': percentile(0.99)
+        }
+
+
+def from_config(config=None):
+    """按配置创建限制器，未启用时返回None"""
+    config = config or load_config()
+    if not config['enabled']:
+        return None
+    return AdaptiveLimiter(
+        config['initial'],
+        config['min_limit'],
+        config['max_limit'],
+        config['tolerance'],
+        config['backoff'],
+        config['base_window']
+    )
+
+
+def format_stats(stats):
+    return (
+        f"自适应并发：当前上限{stats['limit']}，降低{stats['decreases']}次，"
+        f"延迟p50 {stats['p50'] * 1000:.0f}ms、p99 {stats['p99'] * 1000:.0f}ms"
+    )
\ No newline at end of file
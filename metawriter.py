@@ -0,0 +1,117 @@
+import os
+import json
+import queue
+import threading
+import configparser
+
+import metrics
+
+
+def load_config():
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+    return {
+        'batch_size': config.getint('metawriter', 'batch_size', fallback=64),
+        'fsync': config.getboolean('metawriter', 'fsync', fallback=True)
+    }
+
+
+def write_json_atomic(path, data, fsync=True):
+    """先写临时文件再替换，写入中途崩溃不会留下损坏的JSON"""
+    directory = os.path.dirname(path) or '.'
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def apply_tags(dir_path, tags, fsync=True):
+    """把标签合并进metadata.json，保留原有键顺序和已有标签的顺序"""
+    meta_path = os.path.join(dir_path, 'metadata.json')
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        existing = list(data.get('tags', []))
+    else:
+        data = {}
+        existing = []
+    seen = set(existing)
+    added = [t for t in tags if not (t in seen or seen.add(t))]
+    if not added and os.path.exists(meta_path):
+        return
+    data['tags'] = existing + added
+    with metrics.timer('metadata_write'):
+        write_json_atomic(meta_path, data, fsync)
+    metrics.count('metadata_writes')
+
+
+class MetadataWriter:
+    """专用写入线程：按文件夹合并多次更新后批量写入，标注线程不会被磁盘同步阻塞"""
+
+    def __init__(self, config=None):
+        self.config = config or load_config()
+        self.queue = queue.Queue()
+        self.written = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.thread = threading.Thread(target=self._run, name='metawriter', daemon=True)
+        self.thread.start()
+
+    def update(self, dir_path, tags, callback=None):
+        """登记一次更新，写入完成后在写入线程中调用callback(dir_path, error)"""
+        self.queue.put((dir_path, list(tags), callback))
+
+    def close(self):
+        """写完所有已登记的更新后停止写入线程"""
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        running = True
+        while running:
+            first = self.queue.get()
+            if first is None:
+                return
+            batch = [first]
+            # 取出已排队的更新，同一文件夹只写一次
+            while len(batch) < self.config['batch_size']:
+                try:
+                    entry = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is None:
+                    running = False
+                    break
+                batch.append(entry)
+
+            pending = {}
+            for dir_path, tags, callback in batch:
+                if dir_path in pending:
+                    self.coalesced += 1
+                    pending[dir_path][0].extend(tags)
+                else:
+                    pending[dir_path] = (list(tags), [])
+                if callback is not None:
+                    pending[dir_path][1].append(callback)
+
+            for dir_path, (tags, callbacks) in pending.items():
+                error = None
+                try:
+                    apply_tags(dir_path, tags, self.config['fsync'])
+                    self.written += 1
+                except Exception as e:
+                    error = e
+                    self.errors += 1
+                    print(f"更新metadata失败: {dir_path}: {e}")
+                for callback in callbacks:
+                    callback(dir_path, error)
\ No newline at end of file
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import threading
+import contextlib
+import configparser
+
+# 各阶段按处理顺序排列，汇总时按这个顺序输出
+STAGES = ('discovery', 'scene_detection', 'frame_extraction', 'tagging', 'metadata_write')
+STAGE_NAMES = {
+    'discovery': '扫描素材库',
+    'scene_detection': '场景检测',
+    'frame_extraction': '关键帧提取',
+    'tagging': '标注',
+    'metadata_write': '写入metadata'
+}
+
+STARTED = time.time()
+stats_lock = threading.Lock()
+# 阶段 -> [调用次数, 累计秒数, 单次最长秒数]
+TIMINGS = {}
+COUNTERS = {}
+
+
+def load_config():
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+    return {
+        'enabled': config.getboolean('metrics', 'enabled', fallback=False),
+        'jsonl_path': config.get('metrics', 'jsonl_path', fallback='metrics.jsonl').strip(),
+        'prometheus_dir': config.get('metrics', 'prometheus_dir', fallback='').strip()
+    }
+
+
+def observe(stage, seconds):
+    with stats_lock:
+        timing = TIMINGS.setdefault(stage, [0, 0.0, 0.0])
+        timing[0] += 1
+        timing[1] += seconds
+        if seconds > timing[2]:
+            timing[2] = seconds
+
+
+@contextlib.contextmanager
+def timer(stage):
+    """记录一次阶段耗时，多个线程同时处理时累计耗时会超过实际经过的时间"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def count(name, value=1):
+    with stats_lock:
+        COUNTERS[name] = COUNTERS.get(name, 0) + value
+
+
+def take():
+    """取出并清零当前进程的统计，用于从场景检测子进程汇总"""
+    with stats_lock:
+        delta = {'timings': dict(TIMINGS), 'counters': dict(COUNTERS)}
+        TIMINGS.clear()
+        COUNTERS.clear()
+    return delta
+
+
+def merge(delta):
+    with stats_lock:
+        for stage, (calls, seconds, longest) in delta['timings'].items():
+            timing = TIMINGS.setdefault(stage, [0, 0.0, 0.0])
+            timing[0] += calls
+            timing[1] += seconds
+            timing[2] = max(timing[2], longest)
+        for name, value in delta['counters'].items():
+            COUNTERS[name] = COUNTERS.get(name, 0) + value
+
+
+def snapshot():
+    with stats_lock:
+        stages = {
+            stage: {'calls': calls, 'seconds': round(seconds, 6), 'max': round(longest, 6)}
+            for stage, (calls, seconds, longest) in TIMINGS.items()
+        }
+        counters = dict(COUNTERS)
+    ordered = {stage: stages.pop(stage) for stage in STAGES if stage in stages}
+    ordered.update(stages)
+    return {'stages': ordered, 'counters': counters}
+
+
+def format_summary():
+    data = snapshot()
+    lines = [f"各阶段耗时（共运行{time.time() - STARTED:.1f}秒，多线程时为累计耗时）："]
+    for stage, timing in data['stages'].items():
+        average = timing['seconds'] / timing['calls'] if timing['calls'] else 0
+        lines.append(
+            f"  {STAGE_NAMES.get(stage, stage)}：{timing['calls']}次，累计{timing['seconds']:.1f}秒，"
+            f"平均{average * 1000:.0f}ms，最长{timing['max'] * 1000:.0f}ms"
+        )
+    if data['counters']:
+        lines.append('  计数：' + '，'.join(f"{name}={value}" for name, value in sorted(data['counters'].items())))
+    return '\n'.join(lines)
+
+
+def format_prometheus(source, data, elapsed):
+    label = f'source="{source}"'
+    lines = [
+        '# HELP eagle_tagger_stage_seconds_total 各阶段累计耗时',
+        '# TYPE eagle_tagger_stage_seconds_total counter'
+    ]
+    for stage, timing in data['stages'].items():
+        lines.append(f'eagle_tagger_stage_seconds_total{{{label},stage="{stage}"}} {timing["seconds"]}')
+    lines += ['# HELP eagle_tagger_stage_calls_total 各阶段处理次数', '# TYPE eagle_tagger_stage_calls_total counter']
+    for stage, timing in data['stages'].items():
+        lines.append(f'eagle_tagger_stage_calls_total{{{label},stage="{stage}"}} {timing["calls"]}')
+    lines += ['# HELP eagle_tagger_stage_max_seconds 各阶段单次最长耗时', '# TYPE eagle_tagger_stage_max_seconds gauge']
+    for stage, timing in data['stages'].items():
+        lines.append(f'eagle_tagger_stage_max_seconds{{{label},stage="{stage}"}} {timing["max"]}')
+    lines += ['# HELP eagle_tagger_events_total 条目、帧、字节、重试、缓存命中等计数', '# TYPE eagle_tagger_events_total counter']
+    for name, value in sorted(data['counters'].items()):
+        lines.append(f'eagle_tagger_events_total{{{label},name="{name}"}} {value}')
+    lines += [
+        '# HELP eagle_tagger_run_seconds 本次运行总耗时',
+        '# TYPE eagle_tagger_run_seconds gauge',
+        f'eagle_tagger_run_seconds{{{label}}} {elapsed:.3f}',
+        '# HELP eagle_tagger_last_run_timestamp_seconds 本次运行结束时间',
+        '# TYPE eagle_tagger_last_run_timestamp_seconds gauge',
+        f'eagle_tagger_last_run_timestamp_seconds{{{label}}} {time.time():.0f}'
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def write(source, config=None):
+    """运行结束时输出统计：追加一行JSON，和/或写入Prometheus textfile目录"""
+    config = config or load_config()
+    if not config['enabled']:
+        return
+    data = snapshot()
+    elapsed = time.time() - STARTED
+    try:
+        if config['jsonl_path']:
+            record = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'source': source, 'elapsed': round(elapsed, 3)}
+            record.update(data)
+            with open(config['jsonl_path'], 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        if config['prometheus_dir']:
+            os.makedirs(config['prometheus_dir'], exist_ok=True)
+            path = os.path.join(config['prometheus_dir'], f"eagle_tagger_{source}.prom")
+            # 先写临时文件再替换，采集程序不会读到写了一半的文件
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(format_prometheus(source, data, elapsed))
+            os.replace(path + '.tmp', path)
+    except OSError as e:
+        print(f"写入运行统计失败: {e}")
\ No newline at end of file
@@ -0,0 +1,151 @@
+import csv
+import time
+import queue
+import threading
+import configparser
+from concurrent.futures import Future
+
+import numpy as np
+
+# selected_tags.csv中的类别：0为普通标签，4为角色，9为分级
+GENERAL_CATEGORY = 0
+CHARACTER_CATEGORY = 4
+
+
+def load_config():
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+    threshold = config.getfloat('WD14-Tagger', 'wd_threshold', fallback=0.35)
+    return {
+        'model_path': config.get('onnx', 'model_path', fallback='model.onnx'),
+        'labels_path': config.get('onnx', 'labels_path', fallback='selected_tags.csv'),
+        'threshold': threshold,
+        'character_threshold': config.getfloat('onnx', 'character_threshold', fallback=threshold),
+        'batch_size': config.getint('onnx', 'batch_size', fallback=8),
+        'max_wait_ms': config.getfloat('onnx', 'max_wait_ms', fallback=20),
+        'threads': config.getint('onnx', 'threads', fallback=0)
+    }
+
+
+def load_labels(labels_path):
+    """读取WD14格式的标签表，返回(标签名列表, 类别数组)"""
+    names = []
+    categories = []
+    with open(labels_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            names.append(row['name'])
+            categories.append(int(row['category']))
+    return names, np.array(categories)
+
+
+class WD14Model:
+    """在本进程内用ONNX Runtime（CPU）运行WD14格式的标注模型"""
+
+    def __init__(self, model_path, labels_path, threshold, character_threshold, threads=0):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.output_name = self.session.get_outputs()[0].name
+        # 输入为NHWC，批大小维度为动态时才能批量推理
+        batch, height = model_input.shape[0], model_input.shape[1]
+        self.size = height if isinstance(height, int) else 448
+        self.max_batch = batch if isinstance(batch, int) and batch > 0 else None
+
+        self.names, categories = load_labels(labels_path)
+        self.thresholds = np.full(len(self.names), np.inf, dtype=np.float32)
+        self.thresholds[categories == GENERAL_CATEGORY] = threshold
+        self.thresholds[categories == CHARACTER_CATEGORY] = character_threshold
+
+    def preprocess(self, image):
+        """把cv2解码的图片转为模型输入：透明合成白底、补成白边正方形、缩放，BGR float32"""
+        import cv2
+        import imageprep
+        if image.dtype == np.uint16:
+            image = (image / 257).astype(np.uint8)
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        elif image.shape[2] == 4:
+            image = imageprep.flatten_alpha(image)
+        height, width = image.shape[:2]
+        side = max(height, width)
+        top = (side - height) // 2
+        left = (side - width) // 2
+        image = cv2.copyMakeBorder(
+            image, top, side - height - top, left, side - width - left,
+            cv2.BORDER_CONSTANT, value=(255, 255, 255)
+        )
+        interpolation = cv2.INTER_AREA if side > self.size else cv2.INTER_CUBIC
+        image = cv2.resize(image, (self.size, self.size), interpolation=interpolation)
+        return image.astype(np.float32)
+
+    def predict(self, batch):
+        """batch为(N, size, size, 3)，返回(N, 标签数)的置信度"""
+        if self.max_batch is None or len(batch) <= self.max_batch:
+            return self.session.run([self.output_name], {self.input_name: batch})[0]
+        return np.concatenate([
+            self.session.run([self.output_name], {self.input_name: batch[i:i + self.max_batch]})[0]
+            for i in range(0, len(batch), self.max_batch)
+        ])
+
+    def decode(self, probs):
+        """按置信度从高到低输出通过阈值的标签，格式与wd14-tagger-api一致"""
+        picked = np.nonzero(probs >= self.thresholds)[0]
+        picked = picked[np.argsort(-probs[picked], kind='stable')]
+        return ', '.join(self.names[i] for i in picked)
+
+
+class BatchRunner:
+    """把多个标注线程提交的图片攒成一批推理，批满或等待超过max_wait_ms时立即执行"""
+
+    def __init__(self, model, batch_size=8, max_wait_ms=20):
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.images = 0
+        self.thread = threading.Thread(target=self._run, name='onnx-batch', daemon=True)
+        self.thread.start()
+
+    def submit(self, tensor):
+        future = Future()
+        self.queue.put((tensor, future))
+        return future
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        running = True
+        while running:
+            first = self.queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    entry = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is None:
+                    running = False
+                    break
+                batch.append(entry)
+
+            try:
+                probs = self.model.predict(np.stack([tensor for tensor, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.images += len(batch)
+            for (_, future), row in zip(batch, probs):
+                future.set_result(row)
\ No newline at end of file
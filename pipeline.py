@@ -0,0 +1,409 @@
+import os
+import queue
+import time
+import threading
+import configparser
+import traceback
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import findphoto
+import framededup
+import imageprep
+import journal
+import limiter
+import metrics
+import findvideo
+import metawriter
+import processimage
+import processvideo
+import progressive
+import resultcache
+import scheduler
+import tag
+import tagger_client
+
+
+def load_config():
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+    return {
+        'mode': config.get('pipeline', 'mode', fallback='subprocess').strip().lower(),
+        'scene_workers': config.getint('pipeline', 'scene_workers', fallback=1),
+        'image_workers': config.getint('pipeline', 'image_workers', fallback=10),
+        'tag_workers': config.getint('tag', 'threads', fallback=1),
+        'journal': config.get('pipeline', 'journal', fallback='jobs.journal'),
+        'max_attempts': max(1, config.getint('pipeline', 'max_attempts', fallback=3)),
+        'scheduler': scheduler.load_config()
+    }
+
+
+def init_scene_worker():
+    """fork出的子进程会带着父进程已有的统计，先清零，避免汇总时重复计入"""
+    framededup.take_stats()
+    metrics.take()
+
+
+def extract_frames_job(video_path, scene_config):
+    """在场景检测进程池中运行，返回(关键帧, 去重统计, 各阶段统计)"""
+    frames = processvideo.extract_frames(video_path, scene_config)
+    return frames, framededup.take_stats(), metrics.take()
+
+
+class Stage:
+    """流水线中的一个阶段：若干工作线程从输入队列取任务，结果交给下一阶段"""
+
+    def __init__(self, name, func, workers, downstream=None, on_error=None):
+        self.name = name
+        self.func = func
+        self.downstream = downstream
+        self.on_error = on_error
+        self.queue = queue.Queue()
+        self.threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                result = self.func(item)
+            except Exception as e:
+                print(f"[{self.name}] 处理 {item} 失败: {str(e)}")
+                traceback.print_exc()
+                if self.on_error is not None:
+                    self.on_error(item)
+                continue
+            if result is not None and self.downstream is not None:
+                self.downstream.put(result)
+
+    def close(self):
+        """等待队列中的任务全部完成后停止工作线程"""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class WorkItem:
+    """流水线中传递的单个条目"""
+
+    def __init__(self, kind, media_path, state=None, attempts=0, deferred=0):
+        self.kind = kind
+        self.media_path = media_path
+        # 从任务日志恢复时的状态（TAGGED或FRAMES），已完成的阶段不再重复；None表示从头处理
+        self.state = state
+        # 已送入流水线的次数，送入时加一并记入任务日志
+        self.attempts = attempts
+        # 以前的运行中因预算不足或数量上限被推迟的次数，调度时优先处理
+        self.deferred = deferred
+        # 内存中的关键帧[(文件名, JPEG字节)]，None表示关键帧在磁盘上
+        self.frames = None
+        # 标注结果（每张图或每个关键帧一个标签字符串）
+        self.contents = None
+        # 文件内容哈希，用于结果缓存
+        self.digest = None
+        # 有标注请求失败时不标记为已自动标注，下次运行时重试
+        self.failed = False
+
+    def __str__(self):
+        return self.media_path
+
+
+class Pipeline:
+    """单进程流水线：配置和翻译表只加载一次，各阶段之间通过内存队列传递条目
+
+    视频: 场景检测 -> 分析 -> 注入标签
+    图片:           分析 -> 注入标签
+    """
+
+    def __init__(self, config=None):
+        self.config = config or load_config()
+        self.photo_config = findphoto.load_config()
+        self.video_config = findvideo.load_config()
+        self.scene_config = processvideo.load_config()
+        self.tag_config = tag.load_config()
+        self.tag_engine = tag.TagEngine(self.tag_config, tag.load_translations())
+        processimage.load_config()
+
+        self.lock = threading.Lock()
+        self.done = {'image': 0, 'video': 0}
+        # 已送入流水线（或在调度队列中等待）但尚未写入metadata.json的条目
+        self.inflight = set()
+        # 由run()创建；为None时条目一经提交立即送入流水线
+        self.scheduler = None
+        # 多次尝试仍未完成、已放弃的条目，扫描时跳过
+        self.given_up = set()
+        # 本次运行中失败的条目：路径 -> (连续失败次数, 最后一次失败的时间)，监视模式据此推迟重试
+        self.failures = {}
+
+        # 场景检测是CPU密集型，放在进程池中；上传和写入是I/O，用线程
+        self.scene_pool = None
+        if self.config['scene_workers'] > 0:
+            self.scene_pool = ProcessPoolExecutor(
+                max_workers=self.config['scene_workers'], initializer=init_scene_worker
+            )
+
+        self.journal = journal.Journal(self.config['journal'])
+        self.writer = metawriter.MetadataWriter()
+        self.tag_stage = Stage('tag', self._tag, self.config['tag_workers'], on_error=self._dropped)
+        self.image_stage = Stage('processimage', self._analyze, processimage.worker_count(self.config['image_workers']), self.tag_stage,
+                                 self._dropped)
+        self.scene_stage = Stage('processvideo', self._detect_scenes, self.config['scene_workers'], self.image_stage,
+                                 self._dropped)
+
+    def submit(self, media_path, attempts=0, deferred=0):
+        """把一个未标注的图片或视频送入流水线，条目已在处理中或已放弃时返回False"""
+        media_path = str(media_path)
+        with self.lock:
+            if media_path in self.inflight or media_path in self.given_up:
+                return False
+            self.inflight.add(media_path)
+        ext = os.path.splitext(media_path)[1][1:].lower()
+        kind = 'video' if ext in self.video_config['video_exts'] else 'image'
+        item = WorkItem(kind, media_path, attempts=attempts, deferred=deferred)
+        if self.scheduler is not None:
+            # 在调度队列中等待的条目也要记入日志，预算用完时留待下次运行
+            self.journal.record(media_path, journal.DISCOVERED, kind=kind, attempts=attempts)
+        self._enqueue(item)
+        return True
+
+    def _enqueue(self, item):
+        """启用调度时交给调度器安排顺序，否则立即送入流水线"""
+        if self.scheduler is not None:
+            self.scheduler.add(item)
+        else:
+            self.dispatch(item)
+
+    def dispatch(self, item):
+        """记录一次尝试后把条目放入对应阶段的队列"""
+        item.attempts += 1
+        self.journal.record(item.media_path, item.state or journal.DISCOVERED, kind=item.kind,
+                            attempts=item.attempts)
+        if item.state == journal.TAGGED:
+            self.tag_stage.put(item)
+        elif item.kind == 'video' and item.state is None:
+            self.scene_stage.put(item)
+        else:
+            self.image_stage.put(item)
+
+    def resume(self, record):
+        """从任务日志中的最后状态继续处理一个条目，已完成的步骤不再重复
+
+        条目已尝试max_attempts次仍未完成（每次都让某个阶段出错或使程序中断）时记为失败，不再重试。
+        """
+        path = record['path']
+        attempts = record.get('attempts', 0)
+        deferred = record.get('deferred', 0)
+        if attempts >= self.config['max_attempts']:
+            print(f"{path} 已尝试{attempts}次仍未完成，不再重试")
+            metrics.count('items_given_up')
+            self.journal.record(path, journal.FAILED, given_up=True)
+            with self.lock:
+                self.given_up.add(path)
+            return
+        if record['state'] == journal.TAGGED:
+            # 标注结果已在日志中（或仍以.txt留在目录里），只需写入metadata.json
+            item = WorkItem(record['kind'], path, journal.TAGGED, attempts, deferred)
+            item.contents = record.get('contents')
+        elif record['state'] == journal.FRAMES and record.get('on_disk'):
+            # scenedetect命令行写出的关键帧仍在磁盘上，跳过场景检测
+            item = WorkItem(record['kind'], path, journal.FRAMES, attempts, deferred)
+        else:
+            # 清理中断时留下的关键帧和.txt文件后重新处理
+            tag.cleanup_directory(os.path.dirname(os.path.normpath(path)))
+            self.submit(path, attempts, deferred)
+            return
+        with self.lock:
+            self.inflight.add(path)
+        self._enqueue(item)
+
+    def close(self):
+        """按阶段顺序排空队列"""
+        self.scene_stage.close()
+        if self.scene_pool is not None:
+            self.scene_pool.shutdown()
+        self.image_stage.close()
+        processimage.shutdown_prep_pool()
+        processimage.close_backend()
+        self.tag_stage.close()
+        self.writer.close()
+        self.journal.close()
+
+    def _detect_scenes(self, item):
+        # 场景检测前先查结果缓存
+        item.digest, cached = processimage.lookup_cache(item.media_path)
+        if cached is not None:
+            item.contents = cached
+            return item
+        video_path = os.path.abspath(item.media_path)
+        if self.scene_pool is None:
+            item.frames = processvideo.extract_frames(video_path, self.scene_config)
+        else:
+            item.frames, dedup_stats, stage_stats = self.scene_pool.submit(
+                extract_frames_job, video_path, self.scene_config
+            ).result()
+            framededup.add_stats(dedup_stats)
+            metrics.merge(stage_stats)
+        self.journal.record(item.media_path, journal.FRAMES, on_disk=item.frames is None)
+        return item
+
+    def _analyze(self, item):
+        if item.contents is None:
+            self._tag_item(item)
+        if not item.failed:
+            self.journal.record(item.media_path, journal.TAGGED, contents=item.contents)
+        return item
+
+    def _tag_item(self, item):
+        if item.kind == 'image':
+            item.digest, cached = processimage.lookup_cache(item.media_path)
+            if cached is not None:
+                item.contents = cached
+                return
+            content = processimage.tag_image_file(item.media_path)
+            item.contents = [] if content is None else [content]
+            item.failed = content is None
+            if content is not None:
+                processimage.store_cache(item.digest, item.contents)
+        elif item.frames is None:
+            # 关键帧在磁盘上（scenedetect命令行），标注结果同时记入任务日志，
+            # 写入metadata.json前中断时不依赖会被清理掉的.txt文件
+            item.contents, complete = processimage.tag_video_on_disk(
+                Path(item.media_path).resolve(), self.tag_engine, item.digest
+            )
+            item.failed = not complete
+        else:
+            # 关键帧在内存中，直接上传
+            item.contents, complete = processimage.tag_frames(item.frames, item.media_path, self.tag_engine)
+            item.frames = None
+            item.failed = not complete
+            if complete and item.contents:
+                processimage.store_cache(item.digest, item.contents)
+
+    def _tag(self, item):
+        kind = item.kind
+        tag.process_directory(
+            os.path.dirname(os.path.normpath(item.media_path)),
+            self.tag_engine,
+            item.contents or (),
+            self.writer,
+            not item.failed,
+            lambda dir_path, error: self._written(item, error)
+        )
+        with self.lock:
+            self.done[kind] += 1
+            if kind == 'video' and self.done[kind] % 10 == 0:
+                print(f"已标注{self.done[kind]}个视频")
+
+    def start(self):
+        """打开任务日志；有上次中断留下的条目时先继续处理它们，返回恢复的条目数"""
+        records = self.journal.replay().values()
+        pending = [record for record in records if record['state'] not in journal.FINISHED]
+        # 已放弃的条目在新一轮日志中保留，之后扫描时继续跳过；删除任务日志可重新尝试
+        given_up = [record for record in records if record.get('given_up')]
+        self.journal.open(fresh=not pending, keep=given_up)
+        self.given_up.update(record['path'] for record in given_up)
+        if pending:
+            print(f"从任务日志恢复{len(pending)}个未完成的条目...")
+            for record in pending:
+                self.resume(record)
+        return len(pending)
+
+    def discover(self):
+        """扫描素材库，把全部未标注的图片和视频送入流水线"""
+        print("开始处理图片...")
+        photos = findphoto.find_photos(self.photo_config)
+        print(f"共找到{len(photos)}张未标注的图片")
+        for img_path in photos:
+            self.submit(img_path)
+
+        print("\n开始处理视频...")
+        videos = findvideo.find_videos(self.video_config)
+        print(f"共找到{len(videos)}个未标注的视频")
+        for video_path in videos:
+            self.submit(video_path)
+
+    def finish(self):
+        """排空流水线并输出统计"""
+        self.close()
+        print(f"已为{self.done['image']}张图片、{self.done['video']}个视频注入标签。")
+        if self.scene_config['dedup']['enabled']:
+            print(framededup.format_stats())
+        cache = resultcache.get_cache()
+        if cache is not None:
+            print(resultcache.format_stats(cache.stats()))
+        if imageprep.STATS['files']:
+            print(imageprep.format_stats())
+        if progressive.STATS['videos']:
+            print(progressive.format_stats())
+        client = processimage.CLIENT
+        if client is not None and len(client.endpoints) > 1:
+            print(f"标注服务：{tagger_client.format_stats(client.stats())}")
+        if client is not None and client.limiter is not None:
+            print(limiter.format_stats(client.limiter.stats()))
+        print(metrics.format_summary())
+        metrics.write('pipeline')
+        if self.scheduler is not None:
+            self.scheduler.save_history()
+
+    def _dropped(self, item):
+        """某阶段处理失败，条目保留在任务日志中，下次启动时重试"""
+        with self.lock:
+            self.inflight.discard(item.media_path)
+            self._record_failure(item.media_path)
+        if self.scheduler is not None:
+            self.scheduler.done(item.media_path)
+
+    def _written(self, item, error):
+        """metadata.json写入完成（在写入线程中调用）"""
+        state = journal.WRITTEN if error is None and not item.failed else journal.FAILED
+        metrics.count(f"items_{state}")
+        self.journal.record(item.media_path, state)
+        with self.lock:
+            self.inflight.discard(item.media_path)
+            if state == journal.FAILED:
+                self._record_failure(item.media_path)
+            else:
+                self.failures.pop(item.media_path, None)
+        if self.scheduler is not None:
+            self.scheduler.done(item.media_path)
+
+    def _record_failure(self, media_path):
+        """调用时需持有self.lock"""
+        count = self.failures.get(media_path, (0, 0))[0]
+        self.failures[media_path] = (count + 1, time.monotonic())
+
+    def run(self, time_budget=None, max_items=None):
+        """扫描素材库并处理全部未标注的图片和视频
+
+        任务日志中有上次中断留下的条目时先继续处理它们，再扫描其余未标注的条目。
+        启用调度或给出时间预算（秒）、数量上限时，按估计耗时安排顺序，预算用完后不再送入新条目，
+        未处理的条目留在任务日志中。
+        """
+        config = self.config['scheduler']
+        time_budget = config['time_budget'] if time_budget is None else time_budget
+        max_items = config['max_items'] if max_items is None else max_items
+        if config['enabled'] or time_budget or max_items:
+            self.scheduler = scheduler.Scheduler(self, time_budget, max_items, config)
+        self.start()
+        self.discover()
+        if self.scheduler is not None:
+            self.scheduler.feed()
+        self.finish()
+
+
+def main():
+    Pipeline().run()
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
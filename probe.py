@@ -0,0 +1,340 @@
+import os
+import struct
+from collections import namedtuple
+
+# 无法从文件头得到的字段为0
+VideoInfo = namedtuple('VideoInfo', ['width', 'height', 'duration', 'fps', 'frame_count'])
+
+# 读取文件头的上限，moov等索引不在开头时再按偏移跳转
+HEAD_SIZE = 1024 * 1024
+
+
+def probe(path):
+    """只读取容器头部获取视频尺寸、时长、帧率和帧数，不初始化解码器；无法识别时返回None"""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(16)
+            f.seek(0)
+            if head[4:8] in (b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot'):
+                info = probe_mp4(f)
+            elif head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+                info = probe_avi(f)
+            elif head[:6] in (b'GIF87a', b'GIF89a'):
+                info = probe_gif(f)
+            elif head[:3] == b'FLV':
+                info = probe_flv(f)
+            elif head[:4] == b'\x1a\x45\xdf\xa3':
+                info = probe_matroska(f)
+            else:
+                return None
+    except (OSError, struct.error, ValueError, IndexError):
+        return None
+    if info is None or info.width <= 0 or info.height <= 0:
+        return None
+    return info
+
+
+def complete(width, height, duration, fps, frame_count):
+    """根据已知字段补全帧率、帧数或时长"""
+    if not fps and duration and frame_count:
+        fps = frame_count / duration
+    if not frame_count and duration and fps:
+        frame_count = int(round(duration * fps))
+    if not duration and fps and frame_count:
+        duration = frame_count / fps
+    return VideoInfo(int(width), int(height), float(duration or 0), float(fps or 0), int(frame_count or 0))
+
+
+# ---------- MP4 / MOV（ISO BMFF） ----------
+
+def iter_boxes(f, start, end):
+    """遍历[start, end)范围内的box，返回(类型, 内容起点, 内容终点)"""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(16)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack('>I4s', header[:8])
+        body = offset + 8
+        if size == 1:
+            size = struct.unpack('>Q', header[8:16])[0]
+            body = offset + 16
+        elif size == 0:
+            size = end - offset
+        if size < body - offset:
+            return
+        yield kind, body, min(offset + size, end)
+        offset += size
+
+
+def find_box(f, start, end, kind):
+    for box_kind, body, box_end in iter_boxes(f, start, end):
+        if box_kind == kind:
+            return body, box_end
+    return None
+
+
+def probe_mp4(f):
+    file_size = os.fstat(f.fileno()).st_size
+    moov = find_box(f, 0, file_size, b'moov')
+    if moov is None:
+        return None
+    for kind, body, end in iter_boxes(f, *moov):
+        if kind != b'trak':
+            continue
+        mdia = find_box(f, body, end, b'mdia')
+        if mdia is None:
+            continue
+        hdlr = find_box(f, mdia[0], mdia[1], b'hdlr')
+        if hdlr is None:
+            continue
+        f.seek(hdlr[0] + 8)
+        if f.read(4) != b'vide':
+            continue
+
+        # tkhd末尾是16.16定点数的宽高，前面是3x3变换矩阵
+        width = height = 0
+        tkhd = find_box(f, body, end, b'tkhd')
+        if tkhd is not None:
+            f.seek(tkhd[1] - 44)
+            matrix = struct.unpack('>9i', f.read(36))
+            width, height = (v / 65536 for v in struct.unpack('>II', f.read(8)))
+            if matrix[0] == 0 and matrix[4] == 0 and matrix[1] != 0:
+                # 旋转90度或270度的视频，解码后宽高互换
+                width, height = height, width
+
+        duration = 0
+        mdhd = find_box(f, mdia[0], mdia[1], b'mdhd')
+        if mdhd is not None:
+            f.seek(mdhd[0])
+            version = f.read(4)[0]
+            if version == 1:
+                f.seek(16, 1)
+                timescale, length = struct.unpack('>IQ', f.read(12))
+            else:
+                f.seek(8, 1)
+                timescale, length = struct.unpack('>II', f.read(8))
+            duration = length / timescale if timescale else 0
+
+        frame_count = 0
+        minf = find_box(f, mdia[0], mdia[1], b'minf')
+        stbl = find_box(f, minf[0], minf[1], b'stbl') if minf else None
+        stts = find_box(f, stbl[0], stbl[1], b'stts') if stbl else None
+        if stts is not None:
+            f.seek(stts[0] + 4)
+            entries = struct.unpack('>I', f.read(4))[0]
+            # 损坏的文件中条目数可能远大于box本身，只读取box内实际存在的条目
+            entries = min(entries, (stts[1] - stts[0] - 8) // 8)
+            data = f.read(entries * 8)
+            entries = len(data) // 8
+            frame_count = sum(struct.unpack(f'>{entries * 2}I', data[:entries * 8])[0::2])
+        return complete(width, height, duration, 0, frame_count)
+    return None
+
+
+# ---------- AVI ----------
+
+def probe_avi(f):
+    head = f.read(HEAD_SIZE)
+    pos = head.find(b'avih')
+    if pos < 0:
+        return None
+    (usec_per_frame, _, _, _, total_frames, _, _, _, width, height) = struct.unpack_from('<10I', head, pos + 8)
+    fps = 1000000.0 / usec_per_frame if usec_per_frame else 0
+    return complete(width, height, 0, fps, total_frames)
+
+
+# ---------- GIF ----------
+
+def skip_sub_blocks(f):
+    while True:
+        size = f.read(1)
+        if not size or size[0] == 0:
+            return
+        f.seek(size[0], 1)
+
+
+def probe_gif(f):
+    header = f.read(13)
+    width, height, flags = struct.unpack('<HHB', header[6:11])
+    if flags & 0x80:
+        f.seek(3 << ((flags & 0x07) + 1), 1)
+    frames = 0
+    delay_total = 0
+    while True:
+        marker = f.read(1)
+        if not marker or marker == b'\x3b':
+            break
+        if marker == b'\x21':
+            label = f.read(1)
+            if label == b'\xf9':
+                block = f.read(6)
+                delay_total += struct.unpack('<H', block[2:4])[0]
+            else:
+                skip_sub_blocks(f)
+        elif marker == b'\x2c':
+            descriptor = f.read(9)
+            if len(descriptor) < 9:
+                break
+            if descriptor[8] & 0x80:
+                f.seek(3 << ((descriptor[8] & 0x07) + 1), 1)
+            f.seek(1, 1)
+            skip_sub_blocks(f)
+            frames += 1
+        else:
+            break
+    # 帧延迟单位为1/100秒，浏览器把0延迟按0.1秒播放
+    duration = delay_total / 100.0 if delay_total else frames * 0.1
+    return complete(width, height, duration, 0, frames)
+
+
+# ---------- FLV ----------
+
+def read_amf(data, pos):
+    """解析一个AMF0值，返回(值, 新位置)"""
+    kind = data[pos]
+    pos += 1
+    if kind == 0x00:
+        return struct.unpack_from('>d', data, pos)[0], pos + 8
+    if kind == 0x01:
+        return bool(data[pos]), pos + 1
+    if kind == 0x02:
+        length = struct.unpack_from('>H', data, pos)[0]
+        return data[pos + 2:pos + 2 + length].decode('utf-8', 'replace'), pos + 2 + length
+    if kind in (0x03, 0x08):
+        if kind == 0x08:
+            pos += 4
+        result = {}
+        while pos + 3 <= len(data):
+            length = struct.unpack_from('>H', data, pos)[0]
+            if length == 0 and data[pos + 2] == 0x09:
+                return result, pos + 3
+            key = data[pos + 2:pos + 2 + length].decode('utf-8', 'replace')
+            result[key], pos = read_amf(data, pos + 2 + length)
+        return result, pos
+    if kind == 0x0a:
+        count = struct.unpack_from('>I', data, pos)[0]
+        pos += 4
+        items = []
+        for _ in range(count):
+            value, pos = read_amf(data, pos)
+            items.append(value)
+        return items, pos
+    if kind == 0x0b:
+        return struct.unpack_from('>d', data, pos)[0], pos + 10
+    if kind in (0x05, 0x06):
+        return None, pos
+    raise ValueError(f"不支持的AMF0类型: {kind}")
+
+
+def probe_flv(f):
+    head = f.read(HEAD_SIZE)
+    pos = struct.unpack_from('>I', head, 5)[0] + 4
+    # 第一个script tag中的onMetaData
+    while pos + 11 <= len(head):
+        tag_type = head[pos]
+        size = int.from_bytes(head[pos + 1:pos + 4], 'big')
+        if tag_type == 18:
+            data = head[pos + 11:pos + 11 + size]
+            name, offset = read_amf(data, 0)
+            if name == 'onMetaData':
+                meta, _ = read_amf(data, offset)
+                if not isinstance(meta, dict):
+                    return None
+                return complete(
+                    meta.get('width') or 0, meta.get('height') or 0,
+                    meta.get('duration') or 0, meta.get('framerate') or 0, 0
+                )
+        pos += 11 + size + 4
+    return None
+
+
+# ---------- WebM / MKV（EBML） ----------
+
+SEGMENT = 0x18538067
+INFO = 0x1549A966
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+CLUSTER = 0x1F43B675
+
+
+def read_vint(data, pos, keep_marker=False):
+    first = data[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        length += 1
+        mask >>= 1
+    if length > 8:
+        raise ValueError("无效的EBML长度")
+    value = first if keep_marker else first & (mask - 1)
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    # 全1表示长度未知（直播流等）
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return (None if unknown else value), pos + length
+
+
+def iter_elements(data, pos, end):
+    while pos < end:
+        element_id, pos = read_vint(data, pos, keep_marker=True)
+        size, pos = read_vint(data, pos)
+        element_end = end if size is None else min(end, pos + size)
+        yield element_id, pos, element_end
+        pos = element_end
+
+
+def ebml_uint(data, start, end):
+    return int.from_bytes(data[start:end], 'big')
+
+
+def ebml_float(data, start, end):
+    if end - start == 4:
+        return struct.unpack('>f', data[start:end])[0]
+    if end - start == 8:
+        return struct.unpack('>d', data[start:end])[0]
+    return 0.0
+
+
+def probe_matroska(f):
+    data = f.read(HEAD_SIZE)
+    timescale = 1000000
+    duration = 0.0
+    width = height = 0
+    frame_ns = 0
+    for element_id, start, end in iter_elements(data, 0, len(data)):
+        if element_id != SEGMENT:
+            continue
+        for child_id, child_start, child_end in iter_elements(data, start, end):
+            if child_id == INFO:
+                for info_id, s, e in iter_elements(data, child_start, child_end):
+                    if info_id == 0x2AD7B1:
+                        timescale = ebml_uint(data, s, e)
+                    elif info_id == 0x4489:
+                        duration = ebml_float(data, s, e)
+            elif child_id == TRACKS:
+                for entry_id, s, e in iter_elements(data, child_start, child_end):
+                    if entry_id != TRACK_ENTRY or width:
+                        continue
+                    track_type = 0
+                    entry_width = entry_height = entry_frame_ns = 0
+                    for field_id, fs, fe in iter_elements(data, s, e):
+                        if field_id == 0x83:
+                            track_type = ebml_uint(data, fs, fe)
+                        elif field_id == 0x23E383:
+                            entry_frame_ns = ebml_uint(data, fs, fe)
+                        elif field_id == 0xE0:
+                            for video_id, vs, ve in iter_elements(data, fs, fe):
+                                if video_id == 0xB0:
+                                    entry_width = ebml_uint(data, vs, ve)
+                                elif video_id == 0xBA:
+                                    entry_height = ebml_uint(data, vs, ve)
+                    if track_type == 1:
+                        width, height, frame_ns = entry_width, entry_height, entry_frame_ns
+            elif child_id == CLUSTER:
+                # 头部信息都在第一个Cluster之前
+                break
+        break
+    fps = 1e9 / frame_ns if frame_ns else 0
+    return complete(width, height, duration * timescale / 1e9, fps, 0)
\ No newline at end of file
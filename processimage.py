@@ -1,15 +1,39 @@
 import os
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
 import configparser
-import subprocess
 import mimetypes
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import threading
 
+import framededup
+import imageprep
+import limiter
+import metrics
+import progressive
+import resultcache
+import tag
+from tag import FAILED_ITEMS_FILE
+from tagger_client import TaggerClient, TaggerError, parse_urls
+
 # 全局变量和锁
 CONFIG = None
+CLIENT = None
+BACKEND = None
+PREP_POOL = None
+LOGGER = None
+TAG_ENGINE = None
 log_lock = threading.Lock()
 config_lock = threading.Lock()
+client_lock = threading.Lock()
+backend_lock = threading.Lock()
+prep_lock = threading.Lock()
+engine_lock = threading.Lock()
 
 def load_config():
     """读取配置文件（带缓存和线程安全）"""
@@ -22,8 +46,22 @@ def load_config():
                 CONFIG = {
                     'image_types': config['FileTypes']['type1'].split(','),
                     'video_types': config['FileTypes']['type2'].split(','),
-                    'api_url': config['Server']['api_url'],
-                    'log_file': config.get('Logging', 'log_file', fallback='process.log')
+                    'backend': config.get('WD14-Tagger', 'tagger_backend', fallback='http').strip().lower(),
+                    'api_urls': parse_urls(config['Server']['api_url']),
+                    'timeout': config.getfloat('Server', 'timeout', fallback=60),
+                    'retries': config.getint('Server', 'retries', fallback=3),
+                    'backoff': config.getfloat('Server', 'backoff', fallback=0.5),
+                    'max_concurrency': config.getint('Server', 'max_concurrency', fallback=0),
+                    'eject_after': config.getint('Server', 'eject_after', fallback=3),
+                    'eject_seconds': config.getfloat('Server', 'eject_seconds', fallback=30),
+                    'health_interval': config.getfloat('Server', 'health_interval', fallback=10),
+                    'image_workers': config.getint('pipeline', 'image_workers', fallback=10),
+                    'log_file': config.get('Logging', 'log_file', fallback='process.log'),
+                    'failure_file': config.get('Paths', 'failure_file', fallback='failures.jsonl'),
+                    'dedup': framededup.load_config(),
+                    'limiter': limiter.load_config(),
+                    'preprocess': imageprep.load_config(),
+                    'progressive': progressive.load_config()
                 }
             except Exception as e:
                 log_error(f"配置文件读取失败: {str(e)}")
@@ -31,22 +69,256 @@ def load_config():
     return CONFIG
 
 
-def process_path(path_line):
-    """处理单个文件路径（多线程兼容版）"""
+def get_client():
+    """获取共享的标注客户端（连接池在所有线程间复用）"""
+    global CLIENT
+    with client_lock:
+        if CLIENT is None:
+            config = load_config()
+            CLIENT = TaggerClient(
+                config['api_urls'],
+                timeout=config['timeout'],
+                retries=config['retries'],
+                backoff=config['backoff'],
+                # 连接数与标注线程数一致，空闲连接不会因连接池满而被关闭后重连
+                pool_size=worker_count(config['image_workers']),
+                max_concurrency=config['max_concurrency'],
+                eject_after=config['eject_after'],
+                eject_seconds=config['eject_seconds'],
+                health_interval=config['health_interval'],
+                limiter=limiter.from_config(config['limiter'])
+            )
+    return CLIENT
+
+
+def failed(error):
+    """返回取结果时抛出error的函数"""
+    def result():
+        raise error
+    return result
+
+
+def completed(func, *args):
+    """同步执行标注，返回取结果的函数，出错时在取结果时抛出"""
+    try:
+        value = func(*args)
+    except (TaggerError, OSError) as e:
+        return failed(e)
+    return lambda: value
+
+
+class TaggerBackend:
+    """标注后端接口：输入图片文件或图片字节，返回逗号分隔的标签字符串，失败时抛出TaggerError"""
+
+    # 大于1时后端会把同时提交的图片合成一批推理，一个视频的关键帧应先全部提交再取结果
+    batch_size = 1
+
+    def tag_file(self, file_path):
+        raise NotImplementedError
+
+    def tag_bytes(self, data, name, mime_type='image/jpeg'):
+        raise NotImplementedError
+
+    def submit_file(self, file_path):
+        """开始标注，返回取结果的函数（返回标签字符串或抛出TaggerError）；默认在此同步完成"""
+        return completed(self.tag_file, file_path)
+
+    def submit_bytes(self, data, name, mime_type='image/jpeg'):
+        return completed(self.tag_bytes, data, name, mime_type)
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return None
+
+
+class HttpBackend(TaggerBackend):
+    """通过HTTP上传到wd14-tagger-api-server，每次请求一张图"""
+
+    def tag_file(self, file_path):
+        data, name, mime_type = read_upload(file_path)
+        metrics.count('upload_bytes', len(data))
+        return get_client().tag_image(data, name, mime_type)
+
+    def tag_bytes(self, data, name, mime_type='image/jpeg'):
+        metrics.count('upload_bytes', len(data))
+        return get_client().tag_image(data, name, mime_type)
+
+
+class OnnxBackend(TaggerBackend):
+    """在本进程内用ONNX Runtime批量推理，不需要单独启动标注服务
+
+    各标注线程解码和预处理图片，交给同一个批处理线程攒批推理。
+    """
+
+    def __init__(self, config):
+        import onnxtagger
+        self.model = onnxtagger.WD14Model(
+            config['model_path'],
+            config['labels_path'],
+            config['threshold'],
+            config['character_threshold'],
+            config['threads']
+        )
+        self.runner = onnxtagger.BatchRunner(self.model, config['batch_size'], config['max_wait_ms'])
+        self.batch_size = self.runner.batch_size
+
+    def _submit(self, encoded, name):
+        """预处理后交给批处理线程，返回等待推理结果的函数"""
+        import cv2
+        try:
+            image = cv2.imdecode(encoded, cv2.IMREAD_UNCHANGED)
+            tensor = self.model.preprocess(image) if image is not None else None
+        except cv2.error as e:
+            raise TaggerError(f"图片预处理失败: {name}: {str(e)}")
+        if tensor is None:
+            raise TaggerError(f"无法解码图片: {name}")
+        future = self.runner.submit(tensor)
+
+        def result():
+            try:
+                probs = future.result()
+            except Exception as e:
+                raise TaggerError(f"模型推理失败: {type(e).__name__}: {str(e)}")
+            return self.model.decode(probs)
+        return result
+
+    def submit_file(self, file_path):
+        import numpy as np
+        # 用fromfile读取，兼容含中文的路径
+        return self._submit(np.fromfile(str(file_path), dtype=np.uint8), str(file_path))
+
+    def submit_bytes(self, data, name, mime_type='image/jpeg'):
+        import numpy as np
+        return self._submit(np.frombuffer(data, dtype=np.uint8), name)
+
+    def tag_file(self, file_path):
+        return self.submit_file(file_path)()
+
+    def tag_bytes(self, data, name, mime_type='image/jpeg'):
+        return self.submit_bytes(data, name, mime_type)()
+
+    def close(self):
+        self.runner.close()
+
+    def stats(self):
+        return {'batches': self.runner.batches, 'images': self.runner.images}
+
+
+def get_backend():
+    """获取共享的标注后端（[WD14-Tagger] tagger_backend选择http或onnx）"""
+    global BACKEND
+    with backend_lock:
+        if BACKEND is None:
+            if load_config()['backend'] == 'onnx':
+                import onnxtagger
+                BACKEND = OnnxBackend(onnxtagger.load_config())
+            else:
+                BACKEND = HttpBackend()
+    return BACKEND
+
+
+def close_backend():
+    global BACKEND
+    with backend_lock:
+        if BACKEND is not None:
+            BACKEND.close()
+            stats = BACKEND.stats()
+            if stats is not None and stats['batches']:
+                print(f"本地模型推理：{stats['images']}张图片，共{stats['batches']}批，"
+                      f"平均每批{stats['images'] / stats['batches']:.1f}张")
+            BACKEND = None
+
+
+def get_tag_engine():
+    """渐进式标注判断是否有新标签时使用的过滤与翻译（与注入标签时一致）"""
+    global TAG_ENGINE
+    with engine_lock:
+        if TAG_ENGINE is None:
+            TAG_ENGINE = tag.TagEngine(tag.load_config(), tag.load_translations())
+    return TAG_ENGINE
+
+
+def get_prep_pool():
+    """获取上传前缩小图片用的进程池，workers为0时返回None（在标注线程中直接处理）"""
+    global PREP_POOL
+    with prep_lock:
+        if PREP_POOL is None and load_config()['preprocess']['workers'] > 0:
+            PREP_POOL = ProcessPoolExecutor(max_workers=load_config()['preprocess']['workers'])
+    return PREP_POOL
+
+
+def shutdown_prep_pool():
+    global PREP_POOL
+    with prep_lock:
+        if PREP_POOL is not None:
+            PREP_POOL.shutdown()
+            PREP_POOL = None
+
+
+def read_upload(file_path):
+    """读取要上传的图片，启用预处理时先缩小重新编码，返回(字节, 文件名, MIME类型)"""
+    file_path = Path(file_path)
+    config = load_config()['preprocess']
+    if config['enabled']:
+        try:
+            pool = get_prep_pool()
+            if pool is not None:
+                data, name, mime_type, size = pool.submit(imageprep.shrink, str(file_path), config).result()
+            else:
+                data, name, mime_type, size = imageprep.shrink(str(file_path), config)
+            if data is not None:
+                imageprep.add_stats(size, len(data), True)
+                return data, name, mime_type
+        except Exception as e:
+            # 预处理失败时上传原文件，由服务端解码
+            log_error(f"图片预处理失败: {file_path}: {str(e)}")
+    mime_type = mimetypes.guess_type(str(file_path))[0] or 'application/octet-stream'
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if config['enabled']:
+        imageprep.add_stats(len(data), len(data), False)
+    return data, file_path.name, mime_type
+
+
+def worker_count(default=10):
+    """标注线程数：启用自适应并发时要足够让并发上限增长到max_limit"""
+    config = load_config()['limiter']
+    if config['enabled']:
+        return max(default, config['max_limit'])
+    return default
+
+
+def process_path(path_line, engine=None):
+    """处理单个文件路径（多线程兼容版），全部标注成功时返回True"""
     try:
         # 允许接收已处理过的路径字符串
         full_path = Path(path_line.strip()).resolve()
         if not full_path.exists():
             log_error(f"路径不存在: {full_path}")
-            return
+            return False
 
         file_type = determine_file_type(full_path)
         if file_type == "image":
-            process_single_file(full_path)
+            digest, cached = lookup_cache(full_path)
+            if cached is not None:
+                save_result(full_path, cached[0])
+                return True
+            content = process_single_file(full_path)
+            if content is not None:
+                store_cache(digest, [content])
+            return content is not None
         elif file_type == "video":
-            process_video_directory(full_path.parent)
+            # processvideo命中结果缓存时已写出{stem}.txt，不再扫描目录重新标注
+            digest, cached = lookup_cache(full_path)
+            if cached is not None:
+                save_result(full_path, ','.join(cached))
+                return True
+            return tag_video_on_disk(full_path, engine, digest)[1]
     except Exception as e:
         log_error(f"路径处理异常: {str(e)}")
+    return False
 
 
 def determine_file_type(file_path):
@@ -63,39 +335,164 @@ def determine_file_type(file_path):
         return "unknown"
 
 
+def cache_digest(file_path):
+    """文件的内容哈希；缓存未启用或读取失败时为None"""
+    cache = resultcache.get_cache()
+    if cache is None:
+        return None
+    try:
+        return cache.digest(file_path)
+    except OSError as e:
+        log_error(f"计算文件哈希失败: {file_path}: {str(e)}")
+        return None
+
+
+def lookup_cache(file_path):
+    """查询结果缓存，返回(内容哈希, 缓存的标注结果)；缓存未启用时均为None"""
+    digest = cache_digest(file_path)
+    if digest is None:
+        return None, None
+    return digest, resultcache.get_cache().get(digest)
+
+
+def store_cache(digest, contents):
+    cache = resultcache.get_cache()
+    if cache is not None and digest is not None:
+        cache.put(digest, contents)
+
+
+def begin_tagging(submit, on_error):
+    """调用submit()开始标注，返回取结果的函数：成功时返回标签字符串，失败时调用on_error(错误)后返回None"""
+    started = time.monotonic()
+    try:
+        result = submit()
+    except (TaggerError, OSError) as e:
+        result = failed(e)
+
+    def finish():
+        try:
+            content = result()
+        except (TaggerError, OSError) as e:
+            metrics.count('tag_failures')
+            on_error(e)
+            return None
+        metrics.observe('tagging', time.monotonic() - started)
+        metrics.count('tagged_images')
+        return content
+    return finish
+
+
+def begin_image_file(file_path):
+    """开始上传单个图片文件，返回取结果的函数（失败时记录并返回None）"""
+    def on_error(e):
+        if isinstance(e, TaggerError):
+            record_failure(file_path, e)
+        else:
+            log_error(f"读取文件失败: {file_path}: {str(e)}")
+
+    return begin_tagging(lambda: get_backend().submit_file(file_path), on_error)
+
+
+def tag_image_file(file_path):
+    """上传单个图片文件，返回标签字符串，失败时记录并返回None"""
+    return begin_image_file(file_path)()
+
+
+def begin_single_file(file_path):
+    """开始处理单个文件，返回取结果的函数，取结果时同时写出{stem}.txt"""
+    finish = begin_image_file(file_path)
+
+    def save():
+        content = finish()
+        if content is not None:
+            save_result(file_path, content)
+        return content
+    return save
+
+
 def process_single_file(file_path):
     """处理单个文件"""
-    try:
-        mime_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
-        curl_command = [
-            'curl', '-X', 'POST',
-            '-H', 'accept: application/json',
-            '-F', f'file=@{file_path};type={mime_type}',
-            load_config()['api_url']
-        ]
-        result = subprocess.run(curl_command, capture_output=True, text=True)
-        save_result(file_path, result.stdout)
-    except Exception as e:
-        log_error(f"CURL请求失败: {str(e)}")
+    return begin_single_file(file_path)()
 
 
-def process_video_directory(directory):
-    """处理视频目录下的所有图片文件"""
+def tag_video_frames(items, begin, source, engine=None):
+    """标注一个视频的关键帧（按时间顺序），启用渐进式标注时标签收敛后提前停止
+
+    begin(item)开始标注一帧并返回取结果的函数。先提交再取结果，
+    批量推理的后端（onnx）可以把同一视频的关键帧合成一批，而不是每帧单独成批。
+    """
+    if not items:
+        # 没有关键帧时视为失败，否则视频会以空标签被标记为已自动标注
+        log_error(f"视频没有可标注的关键帧: {source}")
+        return [], False
+    config = load_config()['progressive']
+    wave = get_backend().batch_size
+    if config['enabled']:
+        return progressive.tag_in_order(items, begin, engine or get_tag_engine(), config, wave)
+    finishers = [begin(item) for item in items]
+    contents = [content for content in (finish() for finish in finishers) if content is not None]
+    return contents, len(contents) == len(items)
+
+
+def directory_images(directory, skip=()):
+    """视频目录下的图片文件，关键帧文件名带场景序号，排序后即为时间顺序"""
+    config = load_config()
+    return sorted(
+        item for item in directory.iterdir()
+        if item not in skip and item.is_file() and item.suffix[1:].lower() in config['image_types']
+    )
+
+
+def process_video_directory(directory, skip=(), engine=None):
+    """处理视频目录下的所有图片文件，返回(标注结果列表, 是否全部成功)"""
+    return tag_video_frames(directory_images(directory, skip), begin_single_file, directory, engine)
+
+
+def tag_video_on_disk(video_path, engine=None, digest=None):
+    """标注scenedetect命令行写在视频目录中的关键帧，返回(各帧的标签字符串列表, 是否全部成功)
+
+    目录中Eagle的缩略图等其他图片照常标注，但不是视频本身的标注结果，
+    只有关键帧（文件名带-Scene-）的结果写入结果缓存。digest为None时在这里计算。
+    """
     config = load_config()
-    for item in directory.iterdir():
-        if item.is_file() and item.suffix[1:].lower() in config['image_types']:
-            process_single_file(item)
+    skip = set()
+    if config['dedup']['enabled']:
+        skip = framededup.prune_scene_files(video_path.parent, video_path, config['dedup'])
+    files = directory_images(video_path.parent, skip)
+    scenes = [item for item in files if '-Scene-' in item.name]
+    others = [item for item in files if '-Scene-' not in item.name]
+    if not scenes:
+        # 没有关键帧时与以前一样只标注目录中的其他图片，结果不写入缓存
+        return tag_video_frames(others, begin_single_file, video_path.parent, engine)
+    # 先提交缩略图，批量推理的后端可以与关键帧合成一批
+    finishers = [begin_single_file(item) for item in others]
+    contents, complete = tag_video_frames(scenes, begin_single_file, video_path.parent, engine)
+    if complete and contents:
+        store_cache(digest or cache_digest(video_path), contents)
+    extra = [content for content in (finish() for finish in finishers) if content is not None]
+    return contents + extra, complete and len(extra) == len(others)
+
+
+def tag_frames(frames, video_path, engine=None):
+    """直接上传内存中的关键帧，返回(各帧的标签字符串列表, 是否全部成功)"""
+    video_dir = Path(video_path).parent
+
+    def begin(frame):
+        name, data = frame
+        return begin_tagging(
+            lambda: get_backend().submit_bytes(data, name, 'image/jpeg'),
+            lambda e: record_failure(video_dir / name, e)
+        )
 
+    return tag_video_frames(frames, begin, video_path, engine)
 
-def save_result(file_path, curl_output):
+
+def save_result(file_path, content):
     """结果保存与异常处理"""
     try:
         target_dir = file_path.parent
         output_file = target_dir / f"{file_path.stem}.txt"
 
-        # 提取有效内容
-        content = extract_content(curl_output)
-
         # 确保目录存在
         target_dir.mkdir(parents=True, exist_ok=True)
 
@@ -107,22 +504,40 @@ def save_result(file_path, curl_output):
         log_error(f"文件写入失败: {str(e)}")
 
 
-def extract_content(curl_output):
-    """提取有效内容"""
-    try:
-        start = curl_output.find('"') + 1
-        end = curl_output.rfind('"')
-        return curl_output[start:end].replace('，', ',')
-    except Exception:
-        return "内容解析失败"
+def record_failure(file_path, error):
+    """以JSON行记录失败的请求，不写入条目的.txt文件"""
+    record = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'path': str(file_path)}
+    record.update(error.to_dict())
+    with log_lock:
+        config = load_config()
+        with open(config['failure_file'], 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    log_error(f"标注请求失败: {file_path}: {str(error)}")
+
+
+def get_logger():
+    """错误日志先放入内存队列，由后台线程写入日志文件，标注线程不等待磁盘"""
+    global LOGGER
+    with log_lock:
+        if LOGGER is None:
+            # 读取配置失败时也要能记录，不能在这里调用load_config
+            log_file = CONFIG['log_file'] if CONFIG is not None else 'process.log'
+            handler = logging.FileHandler(log_file, encoding='utf-8', delay=True)
+            handler.setFormatter(logging.Formatter('[%(levelname)s] %(message)s'))
+            records = queue.Queue()
+            listener = logging.handlers.QueueListener(records, handler)
+            listener.start()
+            # 进程退出前写完队列中剩余的日志
+            atexit.register(listener.stop)
+            LOGGER = logging.getLogger('processimage')
+            LOGGER.propagate = False
+            LOGGER.addHandler(logging.handlers.QueueHandler(records))
+    return LOGGER
 
 
 def log_error(message):
     """线程安全的日志记录"""
-    with log_lock:
-        config = load_config()
-        with open(config['log_file'], 'a', encoding='utf-8') as f:
-            f.write(f"[ERROR] {message}\n")
+    get_logger().error(message)
 
 
 if __name__ == "__main__":
@@ -131,9 +546,24 @@ if __name__ == "__main__":
         with open('path.txt', 'r', encoding='utf-8') as f:
             paths = [line.strip() for line in f if line.strip()]
 
-        # 创建线程池（可根据CPU核心数调整max_workers）
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            executor.map(process_path, paths)
+        # 创建线程池（可根据CPU核心数调整max_workers），实际并发由自适应限制器控制
+        with ThreadPoolExecutor(max_workers=worker_count()) as executor:
+            results = list(executor.map(process_path, paths))
+        shutdown_prep_pool()
+        close_backend()
+        if CLIENT is not None and CLIENT.limiter is not None:
+            print(limiter.format_stats(CLIENT.limiter.stats()))
+        if imageprep.STATS['files']:
+            print(imageprep.format_stats())
+        if progressive.STATS['videos']:
+            print(progressive.format_stats())
+        metrics.write('processimage')
+
+        # 记录标注失败的条目，tag.py不会将其标记为已自动标注
+        with open(FAILED_ITEMS_FILE, 'w', encoding='utf-8') as f:
+            for path_line, ok in zip(paths, results):
+                if not ok:
+                    f.write(os.path.dirname(os.path.normpath(path_line)) + '\n')
 
     except FileNotFoundError:
         log_error("path.txt文件不存在")
@@ -2,23 +2,37 @@ import os
 import subprocess
 import configparser
 import csv
-import cv2
+
+import animated
+import framededup
+import libindex
+import metrics
+import resultcache
 
 
 def load_config():
     """加载配置文件"""
     config = configparser.ConfigParser()
-    config.read('processvideo.ini')
+    config.read('config.ini', encoding='utf-8')
     return {
         'threshold': config.getint('processvideo', 'threshold', fallback=10),
         'min_scene_len': config.getint('processvideo', 'min_scene_len', fallback=3),
         'max_image_size': config.getint('processvideo', 'max_image_size', fallback=2048),
-        'video_types': [x.strip() for x in config.get('processvideo', 'video_types', fallback='gif,webm').split(',')]
+        'video_types': [x.strip() for x in config.get('processvideo', 'video_types', fallback='gif,webm').split(',')],
+        'scene_engine': config.get('processvideo', 'scene_engine', fallback='cli').strip().lower(),
+        'analysis_width': config.getint('processvideo', 'analysis_width', fallback=256),
+        'frames_in_memory': config.getboolean('processvideo', 'frames_in_memory', fallback=False),
+        'dedup': framededup.load_config(),
+        'animated': animated.load_config()
     }
 
 
 def get_video_dimensions(video_path):
-    """获取视频尺寸"""
+    """获取视频尺寸，优先只读容器头，无法识别的格式才打开解码器"""
+    info = libindex.probe_video(video_path)
+    if info is not None:
+        return info.width, info.height
+    import cv2
     cap = cv2.VideoCapture(video_path)
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
@@ -43,16 +57,23 @@ def analyze_scenes(csv_path):
     return len(scenes), scenes
 
 
-def main():
+def read_path_file():
+    """读取path.txt中的视频路径"""
     # 读取路径文件（增加异常处理）
     try:
         with open('path.txt', 'r', encoding='utf-8-sig') as f:  # 处理BOM头
             raw_path = f.read().strip()
             # 转换路径分隔符
-            video_path = os.path.abspath(raw_path.replace('\\', '/'))
+            return os.path.abspath(raw_path.replace('\\', '/'))
     except Exception as e:
         raise RuntimeError(f"读取路径文件失败: {str(e)}")
 
+
+def process_video(video_path, config):
+    """对单个视频做场景检测并在视频所在目录输出关键帧
+
+    不切换进程工作目录，scenedetect子进程在视频目录下运行，可在同一进程内反复调用。
+    """
     print(f"[DEBUG] 解析后路径: {repr(video_path)}")  # 显示原始字符串
 
     if not os.path.exists(video_path):
@@ -63,68 +84,122 @@ def main():
         print(f'3. 尝试缩短路径层级')
         raise FileNotFoundError(f"视频文件不存在: {video_path}")
 
-    # 处理目录切换（增加异常捕获）
-    video_dir, video_file = os.path.split(video_path)
-    try:
-        os.chdir(video_dir)
-        print(f"[DEBUG] 当前工作目录: {os.getcwd()}")
-    except Exception as e:
-        raise RuntimeError(f"无法进入视频目录 {video_dir}: {str(e)}")
-
-    config = load_config()
     video_dir, video_file = os.path.split(video_path)
-    os.chdir(video_dir)
-
-    # 获取视频信息
-    width, height = get_video_dimensions(video_file)
-    max_dim = max(width, height)
-    image_args = []
-    if max_dim > config['max_image_size']:
-        if width > height:
-            image_args = ['--image-width', str(config['max_image_size'])]
+    if not os.path.isdir(video_dir):
+        raise RuntimeError(f"无法进入视频目录 {video_dir}")
+
+    if animated.can_handle(video_path, config):
+        # GIF动图直接在本进程内逐帧读取，不启动scenedetect
+        try:
+            count = animated.save_keyframes(video_path, config)
+            print(f"[DEBUG] 已从动图提取{count}张关键帧")
+            return
+        except animated.UnsupportedAnimation as e:
+            print(f"{str(e)}，改用场景检测")
+
+    if config['scene_engine'] == 'inprocess':
+        # 进程内单次解码检测，无法解码时回退到scenedetect命令行
+        import sceneengine
+        try:
+            count = sceneengine.save_keyframes(video_path, config)
+            print(f"[DEBUG] 已提取{count}张关键帧")
+            return
+        except sceneengine.VideoOpenError as e:
+            print(f"{str(e)}，改用scenedetect命令行")
+
+    # 命令行同时完成场景检测和关键帧输出，整体计入场景检测
+    with metrics.timer('scene_detection'):
+        # 获取视频信息
+        width, height = get_video_dimensions(video_path)
+        max_dim = max(width, height)
+        image_args = []
+        if max_dim > config['max_image_size']:
+            if width > height:
+                image_args = ['--image-width', str(config['max_image_size'])]
+            else:
+                image_args = ['--image-height', str(config['max_image_size'])]
+
+        # 判断文件类型
+        ext = os.path.splitext(video_file)[1][1:].lower()
+        if ext in config['video_types']:
+            # 直接使用增强检测
+            cmd = [
+                      'scenedetect', '-i', video_file,
+                      'detect-content',
+                      '--threshold', str(config['threshold']),
+                      '--min-scene-len', str(config['min_scene_len']),
+                      'save-images', '--output', '.'
+                  ] + image_args
+            subprocess.run(cmd, check=True, cwd=video_dir)
+            return
+
+        # 生成场景列表
+        csv_cmd = ['scenedetect', '-i', video_file, 'list-scenes']
+        subprocess.run(csv_cmd, check=True, cwd=video_dir)
+
+        # 分析CSV文件
+        csv_name = f"{os.path.splitext(video_file)[0]}-Scenes.csv"
+        scene_count, scene_durations = analyze_scenes(os.path.join(video_dir, csv_name))
+
+        # 判断检测模式
+        if scene_count < 7 or any(d > 30 for d in scene_durations):
+            detector = [
+                'detect-content',
+                '--threshold', str(config['threshold']),
+                '--min-scene-len', str(config['min_scene_len'])
+            ]
         else:
-            image_args = ['--image-height', str(config['max_image_size'])]
+            detector = ['detect-adaptive']
 
-    # 判断文件类型
-    ext = os.path.splitext(video_file)[1][1:].lower()
-    if ext in config['video_types']:
-        # 直接使用增强检测
+        # 执行最终检测
         cmd = [
                   'scenedetect', '-i', video_file,
-                  'detect-content',
-                  '--threshold', str(config['threshold']),
-                  '--min-scene-len', str(config['min_scene_len']),
+                  *detector,
                   'save-images', '--output', '.'
               ] + image_args
-        subprocess.run(cmd, check=True)
-        return
-
-    # 生成场景列表
-    csv_cmd = ['scenedetect', '-i', video_file, 'list-scenes']
-    subprocess.run(csv_cmd, check=True)
-
-    # 分析CSV文件
-    csv_name = f"{os.path.splitext(video_file)[0]}-Scenes.csv"
-    scene_count, scene_durations = analyze_scenes(csv_name)
-
-    # 判断检测模式
-    if scene_count < 7 or any(d > 30 for d in scene_durations):
-        detector = [
-            'detect-content',
-            '--threshold', str(config['threshold']),
-            '--min-scene-len', str(config['min_scene_len'])
-        ]
-    else:
-        detector = ['detect-adaptive']
-
-    # 执行最终检测
-    cmd = [
-              'scenedetect', '-i', video_file,
-              *detector,
-              'save-images', '--output', '.'
-          ] + image_args
-    subprocess.run(cmd, check=True)
+        subprocess.run(cmd, check=True, cwd=video_dir)
+
+
+def extract_frames(video_path, config):
+    """提取关键帧并保留在内存中，返回[(文件名, JPEG字节)]
+
+    未启用内存模式或进程内引擎无法解码时，关键帧照常写入视频目录并返回None。
+    """
+    if config['frames_in_memory'] and animated.can_handle(video_path, config):
+        try:
+            return animated.encode_keyframes(video_path, config)
+        except animated.UnsupportedAnimation as e:
+            print(f"{str(e)}，改用场景检测")
+    if config['scene_engine'] == 'inprocess' and config['frames_in_memory']:
+        import sceneengine
+        try:
+            return sceneengine.encode_keyframes(video_path, config)
+        except sceneengine.VideoOpenError as e:
+            print(f"{str(e)}，改用scenedetect命令行")
+            config = dict(config, scene_engine='cli')
+    process_video(video_path, config)
+    return None
+
+
+def write_cached_result(video_path, contents):
+    """缓存命中时直接写出标注结果，跳过场景检测和上传"""
+    stem = os.path.splitext(video_path)[0]
+    with open(f"{stem}.txt", 'w', encoding='utf-8') as f:
+        f.write(','.join(contents))
+
+
+def main():
+    video_path = read_path_file()
+    cache = resultcache.get_cache()
+    if cache is not None and os.path.exists(video_path):
+        cached = cache.get(cache.digest(video_path))
+        if cached is not None:
+            print(f"[DEBUG] 结果缓存命中: {video_path}")
+            write_cached_result(video_path, cached)
+            return
+    process_video(video_path, load_config())
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
+    metrics.write('processvideo')
\ No newline at end of file
@@ -0,0 +1,95 @@
+import re
+import threading
+import configparser
+
+import metrics
+
+stats_lock = threading.Lock()
+STATS = {'videos': 0, 'frames': 0, 'tagged': 0, 'skipped': 0, 'early_stops': 0}
+
+
+def load_config():
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+    return {
+        'enabled': config.getboolean('progressive', 'enabled', fallback=False),
+        'patience': max(1, config.getint('progressive', 'patience', fallback=4)),
+        'min_frames': max(1, config.getint('progressive', 'min_frames', fallback=3))
+    }
+
+
+def frame_order(count):
+    """由粗到细的标注顺序：首尾两帧，然后中点，再四分点、八分点……"""
+    if count <= 0:
+        return []
+    order = [0] if count == 1 else [0, count - 1]
+    intervals = [(0, count - 1)]
+    while intervals:
+        finer = []
+        for low, high in intervals:
+            if high - low < 2:
+                continue
+            middle = (low + high) // 2
+            order.append(middle)
+            finer += [(low, middle), (middle, high)]
+        intervals = finer
+    return order
+
+
+def new_tags(content, seen, engine):
+    """把一帧的标签（过滤并翻译后）并入seen，返回新增的数量"""
+    before = len(seen)
+    for tag in re.split(r',+', content):
+        translated = engine.translate(tag.strip()) if tag.strip() else None
+        if translated is not None:
+            seen.add(translated)
+    return len(seen) - before
+
+
+def tag_in_order(items, begin, engine, config, wave=1):
+    """按由粗到细的顺序标注，连续patience帧没有新标签时停止
+
+    items为时间顺序排列的关键帧，begin(item)开始标注一帧并返回取结果的函数，
+    取结果时返回标签字符串，失败时返回None。每次按顺序提交wave帧再依次取结果，
+    批量推理的后端可以合成一批；收敛判断在每波之后进行，最多多标注wave-1帧。
+    返回(各帧的标签字符串列表, 已标注的帧是否全部成功)。
+    """
+    contents = []
+    complete = True
+    seen = set()
+    streak = 0
+    tagged = 0
+    order = frame_order(len(items))
+    for start in range(0, len(order), max(1, wave)):
+        if tagged >= config['min_frames'] and streak >= config['patience']:
+            break
+        finishers = [begin(items[index]) for index in order[start:start + max(1, wave)]]
+        for finish in finishers:
+            content = finish()
+            tagged += 1
+            if content is None:
+                # 失败的帧不计入收敛判断
+                complete = False
+                continue
+            contents.append(content)
+            streak = 0 if new_tags(content, seen, engine) else streak + 1
+
+    skipped = len(items) - tagged
+    metrics.count('frames_tagged', tagged)
+    metrics.count('frames_skipped', skipped)
+    with stats_lock:
+        STATS['videos'] += 1
+        STATS['frames'] += len(items)
+        STATS['tagged'] += tagged
+        STATS['skipped'] += skipped
+        if skipped:
+            STATS['early_stops'] += 1
+    return contents, complete
+
+
+def format_stats():
+    with stats_lock:
+        return (
+            f"渐进式标注：{STATS['videos']}个视频共{STATS['frames']}帧，标注{STATS['tagged']}帧，"
+            f"标签收敛后跳过{STATS['skipped']}帧（{STATS['early_stops']}个视频提前停止）"
+        )
\ No newline at end of file
@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+import configparser
+
+import metrics
+
+CACHE = None
+cache_lock = threading.Lock()
+# 每写入一条结果，顺序检查这么多条文件哈希记录，删除文件已不存在的，哈希表不会随改名和删除无限增长
+DIGEST_PRUNE_BATCH = 64
+
+
+def load_config():
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+    return {
+        'enabled': config.getboolean('Cache', 'enabled', fallback=False),
+        'db_path': config.get('Cache', 'db_path', fallback='result_cache.db'),
+        'max_mb': config.getfloat('Cache', 'max_mb', fallback=256),
+        'wd_model': config.get('WD14-Tagger', 'wd_model', fallback='').strip(),
+        'backend': config.get('WD14-Tagger', 'tagger_backend', fallback='http').strip().lower(),
+        'wd_threshold': config.get('WD14-Tagger', 'wd_threshold', fallback='').strip()
+    }
+
+
+def get_cache():
+    """获取共享的结果缓存，未启用时返回None"""
+    global CACHE
+    with cache_lock:
+        if CACHE is None:
+            config = load_config()
+            if not config['enabled']:
+                CACHE = False
+            else:
+                # 本地模型和服务端模型的结果分开缓存
+                model, threshold = config['wd_model'], config['wd_threshold']
+                if config['backend'] == 'onnx':
+                    import onnxtagger
+                    onnx = onnxtagger.load_config()
+                    # 同名的模型文件被替换后结果不同，按路径、大小和修改时间区分；两个阈值都影响结果
+                    model = 'onnx:' + file_signature(onnx['model_path']) + ';' + file_signature(onnx['labels_path'])
+                    threshold = f"{onnx['threshold']}/{onnx['character_threshold']}"
+                CACHE = ResultCache(
+                    config['db_path'],
+                    model,
+                    threshold,
+                    int(config['max_mb'] * 1024 * 1024)
+                )
+    return CACHE or None
+
+
+def file_signature(file_path):
+    """文件的绝对路径、大小和修改时间，文件不存在时只有路径"""
+    file_path = os.path.abspath(file_path)
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return file_path
+    return f"{file_path}|{st.st_size}|{st.st_mtime_ns}"
+
+
+def file_digest(file_path, chunk_size=1024 * 1024):
+    """计算文件内容的哈希"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """以内容哈希+模型+阈值为键的标注结果缓存，按最近使用时间做容量淘汰
+
+    模型或阈值变化后旧条目不会再被命中，只会随LRU淘汰，其他模型的结果不受影响。
+    """
+
+    def __init__(self, db_path, model, threshold, max_bytes):
+        self.model = model
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.pruned = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " digest TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " threshold TEXT NOT NULL,"
+            " contents TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (digest, model, threshold))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results(last_used)")
+        # 记住文件的哈希，同一文件未变化时不用重新读取计算
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS digests ("
+            " path TEXT PRIMARY KEY,"
+            " mtime_ns INTEGER NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " digest TEXT NOT NULL)"
+        )
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        # 下一次检查文件哈希记录的起始rowid；每次运行从随机位置开始，写入不多的运行也能轮流检查到整张表
+        last = self.conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM digests").fetchone()[0]
+        self.prune_cursor = random.randint(0, last)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def digest(self, file_path):
+        """返回文件内容哈希，文件的mtime和大小未变时直接使用记录的值"""
+        file_path = os.path.abspath(str(file_path))
+        st = os.stat(file_path)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT mtime_ns, size, digest FROM digests WHERE path = ?", (file_path,)
+            ).fetchone()
+        if row is not None and row[0] == st.st_mtime_ns and row[1] == st.st_size:
+            return row[2]
+        value = file_digest(file_path)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO digests (path, mtime_ns, size, digest) VALUES (?, ?, ?, ?)",
+                (file_path, st.st_mtime_ns, st.st_size, value)
+            )
+        return value
+
+    def get(self, digest):
+        """命中时返回标注结果列表（每张图或每个关键帧一个标签字符串），否则返回None"""
+        key = (digest, self.model, self.threshold)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT contents FROM results WHERE digest = ? AND model = ? AND threshold = ?", key
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.count('cache_misses')
+                return None
+            self.hits += 1
+            metrics.count('cache_hits')
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE results SET last_used = ? WHERE digest = ? AND model = ? AND threshold = ?",
+                    (time.time(),) + key
+                )
+        return json.loads(row[0])
+
+    def put(self, digest, contents):
+        data = json.dumps(list(contents), ensure_ascii=False)
+        size = len(data.encode('utf-8'))
+        key = (digest, self.model, self.threshold)
+        with self.lock, self.conn:
+            old = self.conn.execute(
+                "SELECT size FROM results WHERE digest = ? AND model = ? AND threshold = ?", key
+            ).fetchone()
+            if old is not None:
+                self.total_bytes -= old[0]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results (digest, model, threshold, contents, size, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                key + (data, size, time.time())
+            )
+            self.total_bytes += size
+            self._evict()
+            self._prune_digests()
+
+    def _evict(self):
+        """超出容量时按最近使用时间淘汰最旧的条目"""
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT rowid, size FROM results ORDER BY last_used LIMIT 256"
+            ).fetchall()
+            if not rows:
+                self.total_bytes = 0
+                return
+            for rowid, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self.conn.execute("DELETE FROM results WHERE rowid = ?", (rowid,))
+                self.total_bytes -= size
+                self.evictions += 1
+
+    def _prune_digests(self):
+        """从上次的位置继续检查一批文件哈希记录，删除文件已不存在的，到表尾后从头开始"""
+        rows = self.conn.execute(
+            "SELECT rowid, path FROM digests WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (self.prune_cursor, DIGEST_PRUNE_BATCH)
+        ).fetchall()
+        self.prune_cursor = rows[-1][0] if len(rows) == DIGEST_PRUNE_BATCH else 0
+        missing = [(rowid,) for rowid, path in rows if not os.path.exists(path)]
+        if missing:
+            self.conn.executemany("DELETE FROM digests WHERE rowid = ?", missing)
+            self.pruned += len(missing)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'pruned': self.pruned,
+            'bytes': self.total_bytes
+        }
+
+
+def format_stats(stats):
+    return (
+        f"结果缓存：命中{stats['hits']}次，未命中{stats['misses']}次，"
+        f"淘汰{stats['evictions']}条，占用{stats['bytes'] / 1024 / 1024:.1f}MB，"
+        f"清理已删除文件的哈希记录{stats['pruned']}条"
+    )
\ No newline at end of file
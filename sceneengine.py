@@ -0,0 +1,237 @@
+import os
+
+import cv2
+import numpy as np
+
+import framededup
+import metrics
+
+# scenedetect list-scenes 默认使用的 detect-content 参数
+DEFAULT_THRESHOLD = 27.0
+DEFAULT_MIN_SCENE_LEN = 15
+# scenedetect detect-adaptive 默认参数
+ADAPTIVE_THRESHOLD = 3.0
+ADAPTIVE_MIN_CONTENT_VAL = 15.0
+ADAPTIVE_WINDOW = 2
+# save-images 默认每个场景保存的图片数和边缘留白帧数
+IMAGES_PER_SCENE = 3
+FRAME_MARGIN = 1
+
+
+class VideoOpenError(Exception):
+    """OpenCV无法解码该视频，需要回退到scenedetect命令行"""
+
+
+def compute_scores(video_path, analysis_width=256):
+    """单次解码计算每帧的内容变化分数（与detect-content相同的HSV平均差）
+
+    返回 (分数数组, 帧率, 宽, 高)。分数在缩小后的帧上计算，分数[0]恒为0。
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise VideoOpenError(f"无法打开视频: {video_path}")
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        factor = max(1, width // analysis_width) if analysis_width > 0 else 1
+        small_size = (max(1, width // factor), max(1, height // factor))
+
+        scores = []
+        prev = None
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if factor > 1:
+                frame = cv2.resize(frame, small_size, interpolation=cv2.INTER_AREA)
+            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+            if prev is None:
+                scores.append(0.0)
+            else:
+                delta = cv2.mean(cv2.absdiff(hsv, prev))
+                scores.append((delta[0] + delta[1] + delta[2]) / 3.0)
+            prev = hsv
+    finally:
+        cap.release()
+
+    if not scores:
+        raise VideoOpenError(f"视频没有可解码的帧: {video_path}")
+    return np.asarray(scores, dtype=np.float32), fps, width, height
+
+
+def content_cuts(scores, threshold, min_scene_len):
+    """detect-content：分数超过阈值且距上一切点足够远时切分"""
+    cuts = []
+    last_cut = 0
+    for frame_num in np.flatnonzero(scores >= threshold):
+        if frame_num - last_cut >= min_scene_len:
+            cuts.append(int(frame_num))
+            last_cut = frame_num
+    return cuts
+
+
+def adaptive_cuts(scores, adaptive_threshold=ADAPTIVE_THRESHOLD, min_scene_len=DEFAULT_MIN_SCENE_LEN,
+                  window=ADAPTIVE_WINDOW, min_content_val=ADAPTIVE_MIN_CONTENT_VAL):
+    """detect-adaptive：分数与前后窗口平均值之比超过阈值时切分"""
+    count = len(scores)
+    if count <= 2 * window:
+        return []
+    # 滑动窗口求和（去掉中心帧）
+    kernel = np.ones(2 * window + 1, dtype=np.float64)
+    window_sum = np.convolve(scores.astype(np.float64), kernel, mode='valid')
+    centers = scores[window:count - window].astype(np.float64)
+    average = (window_sum - centers) / (2 * window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(average > 1e-5, centers / average,
+                         np.where(centers >= min_content_val, 255.0, 0.0))
+
+    cuts = []
+    last_cut = 0
+    candidates = np.flatnonzero((ratio >= adaptive_threshold) & (centers >= min_content_val)) + window
+    for frame_num in candidates:
+        if frame_num - last_cut >= min_scene_len:
+            cuts.append(int(frame_num))
+            last_cut = frame_num
+    return cuts
+
+
+def cuts_to_scenes(cuts, frame_count):
+    """切点列表转为[(起始帧, 结束帧)]，结束帧不包含"""
+    bounds = [0] + [c for c in cuts if 0 < c < frame_count] + [frame_count]
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1) if bounds[i + 1] > bounds[i]]
+
+
+def choose_scenes(scores, fps, config, enhanced):
+    """按原有规则选择检测方式
+
+    增强类型直接用调低阈值的detect-content；其他视频先用默认detect-content，
+    场景数少于7或任一场景超过30秒时改用调低阈值的detect-content，否则用detect-adaptive。
+    """
+    frame_count = len(scores)
+    tuned = content_cuts(scores, config['threshold'], config['min_scene_len'])
+    if enhanced:
+        return cuts_to_scenes(tuned, frame_count)
+
+    default_scenes = cuts_to_scenes(content_cuts(scores, DEFAULT_THRESHOLD, DEFAULT_MIN_SCENE_LEN), frame_count)
+    durations = [(end - start) / fps for start, end in default_scenes]
+    if len(default_scenes) < 7 or any(d > 30 for d in durations):
+        return cuts_to_scenes(tuned, frame_count)
+    return cuts_to_scenes(adaptive_cuts(scores), frame_count)
+
+
+def keyframe_numbers(scenes):
+    """与save-images默认行为一致：每个场景取开头、中间、结尾三帧"""
+    selected = []
+    for scene_num, (start, end) in enumerate(scenes, 1):
+        last = end - 1
+        picks = [
+            min(start + FRAME_MARGIN, last),
+            (start + last) // 2,
+            max(last - FRAME_MARGIN, start)
+        ][:IMAGES_PER_SCENE]
+        for image_num, frame_num in enumerate(picks, 1):
+            selected.append((scene_num, image_num, frame_num))
+    return selected
+
+
+def resize_to_limit(frame, max_image_size):
+    height, width = frame.shape[:2]
+    longest = max(width, height)
+    if longest <= max_image_size:
+        return frame
+    scale = max_image_size / longest
+    return cv2.resize(frame, (max(1, round(width * scale)), max(1, round(height * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+
+def read_frames(video_path, frame_numbers, fps, transform):
+    """按帧号顺序读取帧，返回{帧号: transform(帧)}，相邻帧顺序读取，远处帧直接跳转
+
+    每帧读出后立即交给transform缩小或计算哈希，不保留原始分辨率帧。
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise VideoOpenError(f"无法打开视频: {video_path}")
+    frames = {}
+    position = 0
+    max_gap = max(1, int(fps * 2))
+    try:
+        for target in sorted(set(frame_numbers)):
+            gap = target - position
+            if gap < 0 or gap > max_gap:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+            else:
+                for _ in range(gap):
+                    cap.grab()
+            ok, frame = cap.read()
+            position = target + 1
+            if ok:
+                frames[target] = transform(frame)
+    finally:
+        cap.release()
+    return frames
+
+
+def extract_keyframes(video_path, config):
+    """单次解码检测场景，返回[(文件名, 原始分辨率帧)]"""
+    stem, ext = os.path.splitext(os.path.basename(video_path))
+    enhanced = ext[1:].lower() in config['video_types']
+
+    with metrics.timer('scene_detection'):
+        scores, fps, width, height = compute_scores(video_path, config['analysis_width'])
+        scenes = choose_scenes(scores, fps, config, enhanced)
+    metrics.count('decoded_frames', len(scores))
+    metrics.count('decoded_pixels', len(scores) * width * height)
+
+    with metrics.timer('frame_extraction'):
+        selected = keyframe_numbers(scenes)
+        dedup = config.get('dedup')
+        if dedup and dedup['enabled']:
+            # 先只计算各关键帧的感知哈希完成去重和帧数预算，再读取保留的帧，不同时持有全部关键帧
+            hashes = read_frames(video_path, [frame_num for _, _, frame_num in selected], fps,
+                                 lambda frame: framededup.dhash([frame])[0])
+            selected = [entry for entry in selected if entry[2] in hashes]
+            if selected:
+                kept = framededup.select_hashes(
+                    np.stack([hashes[frame_num] for _, _, frame_num in selected]), len(scores) / fps, dedup
+                )
+                selected = [selected[i] for i in kept]
+        frames = read_frames(video_path, [frame_num for _, _, frame_num in selected], fps,
+                             lambda frame: resize_to_limit(frame, config['max_image_size']))
+
+        keyframes = []
+        for scene_num, image_num, frame_num in selected:
+            frame = frames.get(frame_num)
+            if frame is None:
+                continue
+            name = f"{stem}-Scene-{scene_num:03d}-{image_num:02d}.jpg"
+            keyframes.append((name, frame))
+    if not keyframes:
+        # 跳转后读不出帧等情况，交给scenedetect命令行，不能当作没有标签的视频标记为已标注
+        raise VideoOpenError(f"未能从视频中提取关键帧: {video_path}")
+    metrics.count('keyframes', len(keyframes))
+    return keyframes
+
+
+def encode_keyframes(video_path, config):
+    """检测场景并把关键帧编码为内存中的JPEG，返回[(文件名, JPEG字节)]"""
+    keyframes = extract_keyframes(video_path, config)
+    encoded = []
+    with metrics.timer('frame_extraction'):
+        for name, frame in keyframes:
+            ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
+            if ok:
+                encoded.append((name, buffer.tobytes()))
+    return encoded
+
+
+def save_keyframes(video_path, config):
+    """检测场景并把关键帧写入视频所在目录，返回写入的文件数"""
+    video_dir = os.path.dirname(video_path)
+    frames = encode_keyframes(video_path, config)
+    for name, data in frames:
+        # 直接写字节，兼容含中文的路径
+        with open(os.path.join(video_dir, name), 'wb') as f:
+            f.write(data)
+    return len(frames)
\ No newline at end of file
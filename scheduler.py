@@ -0,0 +1,315 @@
+import os
+import re
+import json
+import time
+import threading
+import configparser
+from collections import namedtuple
+
+import framededup
+import journal
+import libindex
+import metrics
+import processimage
+import progressive
+
+# 没有历史统计时使用的估计值
+DEFAULT_TAG_SECONDS = 0.5
+DEFAULT_PIXEL_SECONDS = 1e-9
+DEFAULT_KEYFRAME_SECONDS = 0.02
+# 预处理（解码、缩小、编码）每MB图片的耗时
+PREP_SECONDS_PER_MB = 0.01
+# 探测不到视频信息时按码率和常见分辨率估计
+DEFAULT_BYTES_PER_SECOND = 500 * 1024
+DEFAULT_VIDEO = (1280, 720, 30.0)
+# 估计耗时用到的阶段和计数，每次运行结束时记入调度历史
+HISTORY_STAGES = ('tagging', 'scene_detection', 'frame_extraction')
+HISTORY_COUNTERS = ('decoded_pixels', 'keyframes')
+
+# 以前的运行中推迟次数多的排在前面（priority为负的推迟次数），其余按估计耗时从小到大
+Entry = namedtuple('Entry', ['priority', 'cost', 'path', 'kind', 'work', 'item'])
+# 运行结束时最多列出的推迟条目数，完整列表在任务日志中（deferred字段）
+LIST_DEFERRED = 50
+
+
+def load_config():
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+    return {
+        'enabled': config.getboolean('scheduler', 'enabled', fallback=False),
+        'time_budget': parse_duration(config.get('scheduler', 'time_budget', fallback='0')),
+        'max_items': config.getint('scheduler', 'max_items', fallback=0),
+        'history_path': config.get('scheduler', 'history_path', fallback='scheduler_history.jsonl').strip(),
+        'history_runs': config.getint('scheduler', 'history_runs', fallback=20),
+        'queue_factor': max(1, config.getint('scheduler', 'queue_factor', fallback=2))
+    }
+
+
+def parse_duration(value):
+    """把"90m"、"2h"、"1h30m"、"3600"（秒）解析为秒数"""
+    value = str(value).strip().lower()
+    if not value:
+        return 0
+    if re.fullmatch(r'\d+(\.\d+)?', value):
+        return float(value)
+    parts = re.findall(r'(\d+(?:\.\d+)?)\s*([hms])', value)
+    if not parts or ''.join(n + u for n, u in parts) != re.sub(r'\s+', '', value):
+        raise ValueError(f"无法识别的时长: {value}")
+    return sum(float(number) * {'h': 3600, 'm': 60, 's': 1}[unit] for number, unit in parts)
+
+
+class Throughput:
+    """各阶段的单位耗时，来自最近几次运行的调度历史和本次运行已完成的部分
+
+    调度历史由调度器自己记录，与[metrics]是否启用无关。
+    """
+
+    def __init__(self, history_path='', history_runs=20):
+        self.history = self._read_history(history_path, history_runs)
+
+    @staticmethod
+    def _read_history(history_path, history_runs):
+        totals = {'stages': {}, 'counters': {}}
+        if not history_path or history_runs <= 0:
+            return totals
+        try:
+            with open(history_path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()[-history_runs:]
+        except OSError:
+            return totals
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            for stage, timing in record.get('stages', {}).items():
+                total = totals['stages'].setdefault(stage, [0, 0.0])
+                total[0] += timing['calls']
+                total[1] += timing['seconds']
+            for name, value in record.get('counters', {}).items():
+                totals['counters'][name] = totals['counters'].get(name, 0) + value
+        return totals
+
+    def rates(self):
+        """返回(每次标注秒数, 每解码一个像素秒数, 每提取一张关键帧秒数)"""
+        current = metrics.snapshot()
+        stages = {stage: list(total) for stage, total in self.history['stages'].items()}
+        for stage, timing in current['stages'].items():
+            total = stages.setdefault(stage, [0, 0.0])
+            total[0] += timing['calls']
+            total[1] += timing['seconds']
+        counters = dict(self.history['counters'])
+        for name, value in current['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+
+        def per(stage, counter, default):
+            calls, seconds = stages.get(stage, (0, 0.0))
+            amount = counters.get(counter, 0) if counter else calls
+            return seconds / amount if amount and seconds else default
+
+        return (
+            per('tagging', None, DEFAULT_TAG_SECONDS),
+            per('scene_detection', 'decoded_pixels', DEFAULT_PIXEL_SECONDS),
+            per('frame_extraction', 'keyframes', DEFAULT_KEYFRAME_SECONDS)
+        )
+
+    @staticmethod
+    def write_history(history_path, history_runs):
+        """把本次运行的各阶段耗时追加到调度历史，只保留最近history_runs次"""
+        if not history_path or history_runs <= 0:
+            return
+        current = metrics.snapshot()
+        stages = {stage: {'calls': timing['calls'], 'seconds': timing['seconds']}
+                  for stage, timing in current['stages'].items() if stage in HISTORY_STAGES}
+        if not stages:
+            return
+        counters = {name: value for name, value in current['counters'].items() if name in HISTORY_COUNTERS}
+        record = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'stages': stages, 'counters': counters}
+        try:
+            try:
+                with open(history_path, 'r', encoding='utf-8') as f:
+                    lines = f.readlines()[-(history_runs - 1):] if history_runs > 1 else []
+            except FileNotFoundError:
+                lines = []
+            lines.append(json.dumps(record, ensure_ascii=False) + '\n')
+            # 先写临时文件再替换，中断时不会留下写了一半的历史
+            with open(history_path + '.tmp', 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            os.replace(history_path + '.tmp', history_path)
+        except OSError as e:
+            print(f"写入调度历史失败: {e}")
+
+
+class Scheduler:
+    """按估计耗时安排条目的处理顺序，并在时间预算或数量上限用完时停止送入新条目
+
+    图片和视频分别按耗时从小到大排列，各自只在对应阶段有空闲时送入，
+    视频解码（CPU）和图片标注（标注服务）同时进行。从任务日志恢复的条目同样经过调度，
+    已提取关键帧或已标注的视频不再占用场景检测。没有送入的条目保留在任务日志中，下次运行时继续。
+    以前推迟过的条目排在最前面，每类允许一个推迟过的条目超出剩余预算，耗时大的条目不会永远得不到处理。
+    """
+
+    def __init__(self, pipeline, time_budget=0, max_items=0, config=None):
+        self.config = config or load_config()
+        self.progressive = progressive.load_config()
+        self.pipeline = pipeline
+        self.time_budget = time_budget
+        self.max_items = max_items
+        self.started = time.monotonic()
+        self.throughput = Throughput(self.config['history_path'], self.config['history_runs'])
+        self.queued = {'image': [], 'video': []}
+        self.active = {'image': set(), 'video': set()}
+        self.condition = threading.Condition()
+        self.dispatched = 0
+        self.deferred = []
+        # 本次运行中是否已送入过超出剩余预算的条目
+        self.overrun = {'image': False, 'video': False}
+
+    def add(self, item):
+        self.queued[self.lane(item)].append(item)
+
+    @staticmethod
+    def lane(item):
+        """需要场景检测的视频归入视频类，图片和从任务日志恢复、已过场景检测的视频归入图片类"""
+        return 'video' if item.kind == 'video' and item.state is None else 'image'
+
+    def done(self, media_path):
+        """条目写入完成或某阶段失败时由流水线调用"""
+        with self.condition:
+            for active in self.active.values():
+                active.discard(media_path)
+            self.condition.notify_all()
+
+    def measure(self, item):
+        """统计一个条目尚未完成部分的工作量：(标注次数, 解码像素数, 提取关键帧数, 预处理MB数)
+
+        需要探测视频信息，每个条目只统计一次；单位耗时更新后用estimate重新换算。
+        """
+        media_path = item.media_path
+        if item.state == journal.TAGGED:
+            # 只剩写入metadata.json
+            return 0, 0, 0, 0
+        try:
+            size = os.path.getsize(media_path)
+        except OSError:
+            size = 0
+        if item.kind == 'image':
+            return 1, 0, 0, size / 1024 / 1024
+
+        info = libindex.probe_video(media_path)
+        if info is not None and info.duration > 0:
+            duration, pixels = info.duration, info.width * info.height
+            frame_count = info.frame_count or duration * DEFAULT_VIDEO[2]
+        else:
+            duration = size / DEFAULT_BYTES_PER_SECOND
+            pixels = DEFAULT_VIDEO[0] * DEFAULT_VIDEO[1]
+            frame_count = duration * DEFAULT_VIDEO[2]
+        keyframes = self.keyframe_estimate(duration)
+        if item.state == journal.FRAMES:
+            # 关键帧已在磁盘上，只剩标注
+            return keyframes, 0, 0, 0
+        return keyframes, frame_count * pixels, keyframes, 0
+
+    @staticmethod
+    def estimate(work, rates):
+        """按各阶段的单位耗时估计一个条目占用工作线程的秒数"""
+        tags, pixels, keyframes, megabytes = work
+        tag_seconds, pixel_seconds, keyframe_seconds = rates
+        return (tags * tag_seconds + pixels * pixel_seconds + keyframes * keyframe_seconds
+                + megabytes * PREP_SECONDS_PER_MB)
+
+    def keyframe_estimate(self, duration):
+        """一个视频预计要标注的关键帧数"""
+        scene_config = self.pipeline.scene_config
+        if scene_config['dedup']['enabled']:
+            frames = framededup.frame_budget(duration, scene_config['dedup'])
+        else:
+            frames = max(3, round(duration / 10) * 3)
+        if self.progressive['enabled']:
+            # 渐进式标注通常在标注min_frames+patience帧后停止
+            frames = min(frames, self.progressive['min_frames'] + self.progressive['patience'])
+        return frames
+
+    def order(self):
+        """各类条目按估计耗时从小到大排列，同一预算内能完成尽量多的条目"""
+        rates = self.throughput.rates()
+        ordered = {}
+        for kind, items in self.queued.items():
+            entries = []
+            for item in items:
+                work = self.measure(item)
+                entries.append(Entry(-item.deferred, self.estimate(work, rates), item.media_path, kind, work, item))
+            ordered[kind] = sorted(entries)
+            self.queued[kind] = []
+        return ordered
+
+    def capacity(self, kind):
+        """各类条目同时在流水线中的上限，按对应阶段实际的工作线程数计算"""
+        config = self.pipeline.config
+        if kind == 'video':
+            workers = config['scene_workers']
+        else:
+            # 启用自适应并发时标注阶段的线程数按max_limit放大，与流水线中的一致
+            workers = processimage.worker_count(config['image_workers'])
+        return max(1, workers) * self.config['queue_factor']
+
+    def remaining(self):
+        if not self.time_budget:
+            return None
+        return self.time_budget - (time.monotonic() - self.started)
+
+    def feed(self):
+        """把排好序的条目送入流水线，阻塞到全部送入或预算用完"""
+        ordered = self.order()
+        total = sum(len(entries) for entries in ordered.values())
+        if total:
+            print(f"按估计耗时安排{total}个条目（图片{len(ordered['image'])}个、视频{len(ordered['video'])}个）")
+        while any(ordered.values()):
+            if self.max_items and self.dispatched >= self.max_items:
+                break
+            with self.condition:
+                ready = [kind for kind, entries in ordered.items()
+                         if entries and len(self.active[kind]) < self.capacity(kind)]
+                if not ready:
+                    self.condition.wait(timeout=1.0)
+                    continue
+                # 两类都有空闲时先送入推迟过的，再送入耗时较小的
+                kind = min(ready, key=lambda k: ordered[k][0][:2])
+                entry = ordered[kind][0]
+                remaining = self.remaining()
+                if remaining is not None and remaining <= 0:
+                    break
+                ordered[kind].pop(0)
+                if remaining is not None and entry.cost > remaining:
+                    if not entry.item.deferred or self.overrun[kind]:
+                        self.deferred.append(entry)
+                        continue
+                    # 以前已因预算不足推迟过，预算再长也可能放不下，本次与耗时小的条目一起处理
+                    self.overrun[kind] = True
+                    print(f"{entry.path} 已推迟{entry.item.deferred}次，估计耗时{entry.cost:.0f}秒超出剩余预算，本次仍然处理")
+                self.active[kind].add(entry.path)
+            self.pipeline.dispatch(entry.item)
+            self.dispatched += 1
+            if self.dispatched % 50 == 0:
+                # 按本次运行已完成部分的实际耗时重新换算，工作量不再重新统计
+                rates = self.throughput.rates()
+                for entries in ordered.values():
+                    entries[:] = sorted(e._replace(cost=self.estimate(e.work, rates)) for e in entries)
+
+        left = sorted(self.deferred + [entry for entries in ordered.values() for entry in entries])
+        if left:
+            metrics.count('deferred_items', len(left))
+            reason = '达到数量上限' if self.max_items and self.dispatched >= self.max_items else '时间预算不足'
+            print(f"{reason}，已送入{self.dispatched}个条目，剩余{len(left)}个留在任务日志中，下次运行时优先处理：")
+            for entry in left:
+                # 记录推迟次数，下次运行时排在前面
+                self.pipeline.journal.record(entry.path, entry.item.state or journal.DISCOVERED,
+                                             deferred=entry.item.deferred + 1)
+            for entry in left[:LIST_DEFERRED]:
+                print(f"  {entry.path}（估计{entry.cost:.0f}秒，已推迟{entry.item.deferred + 1}次）")
+            if len(left) > LIST_DEFERRED:
+                print(f"  ……等{len(left)}个")
+
+    def save_history(self):
+        """运行结束时记录本次的各阶段耗时，供以后的运行估计"""
+        Throughput.write_history(self.config['history_path'], self.config['history_runs'])
\ No newline at end of file
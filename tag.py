@@ -1,9 +1,16 @@
 import os
 import re
-import json
+import pickle
 import configparser
 from concurrent.futures import ThreadPoolExecutor
 
+import metawriter
+import metrics
+from libindex import TAGGED_MARK
+
+# processimage记录本次运行中标注失败的条目文件夹
+FAILED_ITEMS_FILE = 'failed_items.txt'
+
 
 def load_config():
     config = configparser.ConfigParser()
@@ -16,44 +23,97 @@ def load_config():
     }
 
 
-def load_translations():
+def parse_translations(csv_path):
     translations = {}
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                print(f"警告: CSV第{line_num}行为空")
+                continue
+            if ',' not in line:
+                raise ValueError(f"CSV第{line_num}行格式错误，缺少逗号")
+            en, zh = map(str.strip, line.split(',', 1))
+            if not en or not zh:
+                raise ValueError(f"CSV第{line_num}行存在空字段")
+            translations[en] = zh
+    return translations
+
+
+def load_translations(csv_path='Tags-zh.csv'):
+    """加载翻译表，优先读取预编译的二进制缓存，CSV变化后才重新解析"""
+    cache_path = csv_path + '.cache'
     try:
-        with open('Tags-zh.csv', 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f, 1):
-                line = line.strip()
-                if not line:
-                    print(f"警告: CSV第{line_num}行为空")
-                    continue
-                if ',' not in line:
-                    raise ValueError(f"CSV第{line_num}行格式错误，缺少逗号")
-                en, zh = map(str.strip, line.split(',', 1))
-                if not en or not zh:
-                    raise ValueError(f"CSV第{line_num}行存在空字段")
-                translations[en] = zh
+        st = os.stat(csv_path)
+        signature = (st.st_mtime_ns, st.st_size)
+        try:
+            with open(cache_path, 'rb') as f:
+                cached_signature, translations = pickle.load(f)
+            if cached_signature == signature:
+                return translations
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+            pass
+
+        translations = parse_translations(csv_path)
+        try:
+            tmp_path = cache_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump((signature, translations), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"写入翻译缓存失败: {e}")
     except Exception as e:
         print(f"加载翻译文件失败: {e}")
         exit(1)
     return translations
 
 
-def process_tags(tags, config, translations):
-    filtered = []
-    for tag in tags:
+class TagEngine:
+    """预编译的标签过滤与翻译
+
+    正则过滤和男女数量过滤合并为一个编译好的正则，精确过滤使用frozenset，
+    每个原始标签的处理结果只计算一次。
+    """
+
+    def __init__(self, config, translations):
+        patterns = [p for p in (config['regex_filter'], config['gender_regex']) if p]
+        self.pattern = re.compile('|'.join(f'(?:{p})' for p in patterns), re.I) if patterns else None
+        self.exact_tags = frozenset(config['exact_tags'])
+        self.translations = translations
+        self.memo = {}
+
+    def translate(self, tag):
+        """返回过滤并翻译后的标签，被过滤时返回None"""
+        try:
+            return self.memo[tag]
+        except KeyError:
+            pass
         tag_clean = tag.strip()
-        if config['regex_filter'] and re.search(config['regex_filter'], tag_clean, re.I):
-            continue
-        if tag_clean in config['exact_tags']:
-            continue
-        if config['gender_regex'] and re.search(config['gender_regex'], tag_clean, re.I):
-            continue
-        filtered.append(translations.get(tag_clean, tag_clean))
-    return list(set(filtered))
-
-
-def process_directory(dir_path, config, translations):
-    # 合并标签
+        if tag_clean in self.exact_tags or (self.pattern is not None and self.pattern.search(tag_clean)):
+            result = None
+        else:
+            result = self.translations.get(tag_clean, tag_clean)
+        self.memo[tag] = result
+        return result
+
+    def process(self, tags):
+        translated = {self.translate(tag) for tag in tags}
+        translated.discard(None)
+        return list(translated)
+
+
+def process_directory(dir_path, engine, contents=(), writer=None, mark=True, callback=None):
+    """合并标注结果并更新metadata.json
+
+    mark为True时同时加上【已自动标注】；传入writer时交给写入线程批量写入，
+    写入完成后调用callback(dir_path, error)。写入成功后才清理.txt等中间文件。
+    """
+    # 合并标签（contents为直接在内存中传入的标注结果）
     tags = set()
+    for content in contents:
+        content = content.strip()
+        if content:
+            tags.update([t.strip() for t in re.split(r',+', content)])
     for filename in os.listdir(dir_path):
         if filename.endswith('.txt'):
             with open(os.path.join(dir_path, filename), 'r', encoding='utf-8') as f:
@@ -62,26 +122,32 @@ def process_directory(dir_path, config, translations):
                     tags.update([t.strip() for t in re.split(r',+', content)])
 
     # 过滤翻译
-    processed_tags = process_tags(tags, config, translations)
-
-    # 更新metadata.json
-    meta_path = os.path.join(dir_path, 'metadata.json')
-    try:
-        if os.path.exists(meta_path):
-            with open(meta_path, 'r+', encoding='utf-8') as f:
-                data = json.load(f)
-                existing = set(data.get('tags', []))
-                data['tags'] = list(existing.union(processed_tags))
-                f.seek(0)
-                json.dump(data, f, indent=2, ensure_ascii=False)
-                f.truncate()
-        else:
-            with open(meta_path, 'w', encoding='utf-8') as f:
-                json.dump({'tags': processed_tags}, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        print(f"更新metadata失败: {e}")
-
-    # 清理文件
+    processed_tags = sorted(engine.process(tags))
+    if mark:
+        processed_tags.append(TAGGED_MARK)
+
+    def written(dir_path, error):
+        # 写入失败时保留中间文件，下次运行时结果仍在
+        if error is None:
+            cleanup_directory(dir_path)
+        if callback is not None:
+            callback(dir_path, error)
+
+    # 更新metadata.json（写临时文件后替换）
+    if writer is not None:
+        writer.update(dir_path, processed_tags, written)
+    else:
+        error = None
+        try:
+            metawriter.apply_tags(dir_path, processed_tags)
+        except Exception as e:
+            error = e
+            print(f"更新metadata失败: {e}")
+        written(dir_path, error)
+
+
+def cleanup_directory(dir_path):
+    """清理场景检测和标注过程中留下的中间文件"""
     for filename in os.listdir(dir_path):
         if any([filename.endswith(ext) for ext in ('.txt', '.csv')]) or '-Scene-' in filename:
             try:
@@ -90,17 +156,35 @@ def process_directory(dir_path, config, translations):
                 pass
 
 
+def read_failed_items():
+    """读取processimage记录的本次标注失败的条目文件夹"""
+    try:
+        with open(FAILED_ITEMS_FILE, 'r', encoding='utf-8') as f:
+            return {os.path.normpath(line.strip()) for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+
 def main():
     config = load_config()
-    translations = load_translations()
+    engine = TagEngine(config, load_translations())
 
     with open('path.txt', 'r', encoding='utf-8') as f:
         paths = [os.path.dirname(os.path.normpath(line.strip())) for line in f if line.strip()]
 
-    with ThreadPoolExecutor(max_workers=config['threads']) as executor:
-        for path in paths:
-            executor.submit(process_directory, path, config, translations)
+    # 标注失败的条目不标记为已自动标注，下次运行时重试
+    failed = read_failed_items()
+    writer = metawriter.MetadataWriter()
+    try:
+        with ThreadPoolExecutor(max_workers=config['threads']) as executor:
+            for path in paths:
+                executor.submit(process_directory, path, engine, (), writer, os.path.normpath(path) not in failed)
+    finally:
+        writer.close()
+    if os.path.exists(FAILED_ITEMS_FILE):
+        os.remove(FAILED_ITEMS_FILE)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
+    metrics.write('tag')
\ No newline at end of file
@@ -0,0 +1,314 @@
+import json
+import time
+import uuid
+import queue
+import random
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+import metrics
+
+
+class TaggerError(Exception):
+    """标注请求失败，带有可结构化记录的字段"""
+
+    def __init__(self, message, url=None, status=None, attempts=0):
+        super().__init__(message)
+        self.url = url
+        self.status = status
+        self.attempts = attempts
+
+    def to_dict(self):
+        return {
+            'error': str(self),
+            'url': self.url,
+            'status': self.status,
+            'attempts': self.attempts
+        }
+
+
+class ConnectionPool:
+    """同一主机的keep-alive连接池（线程安全）"""
+
+    def __init__(self, url, maxsize=10, timeout=60):
+        parts = urlsplit(url)
+        self.scheme = parts.scheme or 'http'
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path += '?' + parts.query
+        self.timeout = timeout
+        self.idle = queue.LifoQueue(maxsize)
+
+    def _new_connection(self):
+        cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def get(self):
+        """取出一个连接，返回(连接, 是否为复用的旧连接)"""
+        try:
+            return self.idle.get_nowait(), True
+        except queue.Empty:
+            return self._new_connection(), False
+
+    def put(self, conn):
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def encode_multipart(field, filename, data, mime_type):
+    """构造multipart/form-data请求体"""
+    boundary = uuid.uuid4().hex
+    safe_name = filename.replace('"', '_')
+    head = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="{field}"; filename="{safe_name}"\r\n'
+        f'Content-Type: {mime_type}\r\n\r\n'
+    ).encode('utf-8')
+    tail = f'\r\n--{boundary}--\r\n'.encode('ascii')
+    return head + data + tail, f'multipart/form-data; boundary={boundary}'
+
+
+def parse_response(body):
+    """解析wd14-tagger-api返回的JSON，得到逗号分隔的标签字符串"""
+    try:
+        result = json.loads(body)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise TaggerError(f"响应不是有效的JSON: {str(e)}")
+    if isinstance(result, dict):
+        result = result.get('tags', result.get('caption'))
+    if isinstance(result, list):
+        result = ', '.join(str(t) for t in result)
+    if not isinstance(result, str):
+        raise TaggerError(f"无法识别的响应格式: {str(body[:200])}")
+    return result.replace('，', ',')
+
+
+class Endpoint:
+    """一个标注服务实例：连接池、进行中的请求数和健康状态"""
+
+    def __init__(self, url, pool_size=10, timeout=60, max_concurrency=0):
+        self.url = url
+        self.pool = ConnectionPool(url, maxsize=pool_size, timeout=timeout)
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def available(self, now):
+        return self.ejected_until <= now
+
+    def has_capacity(self):
+        return self.max_concurrency <= 0 or self.outstanding < self.max_concurrency
+
+    def load(self):
+        """用于最少进行中请求的负载值，按并发上限折算，上限不同的实例也能公平比较"""
+        if self.max_concurrency > 0:
+            return self.outstanding / self.max_concurrency
+        return self.outstanding
+
+
+class TaggerClient:
+    """wd14-tagger-api的HTTP客户端：连接池复用、超时和带退避的有限重试
+
+    api_url可以是多个服务实例，按最少进行中请求分配；连续失败的实例被暂时剔除，
+    后台健康检查或剔除时间到期后重新加入。
+    """
+
+    def __init__(self, api_url, timeout=60, retries=3, backoff=0.5, pool_size=10,
+                 max_concurrency=0, eject_after=3, eject_seconds=30, health_interval=10, limiter=None):
+        urls = [api_url] if isinstance(api_url, str) else list(api_url)
+        if not urls:
+            raise ValueError("至少需要一个api_url")
+        self.api_url = urls[0]
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.timeout = timeout
+        self.eject_after = max(1, eject_after)
+        self.eject_seconds = eject_seconds
+        self.limiter = limiter
+        self.endpoints = [Endpoint(url, pool_size, timeout, max_concurrency) for url in urls]
+        self.condition = threading.Condition()
+        self.closed = threading.Event()
+        self.health_thread = None
+        if len(self.endpoints) > 1 and health_interval > 0:
+            self.health_thread = threading.Thread(
+                target=self._health_loop, args=(health_interval,), name='tagger-health', daemon=True
+            )
+            self.health_thread.start()
+
+    def close(self):
+        self.closed.set()
+        if self.health_thread is not None:
+            self.health_thread.join()
+        for endpoint in self.endpoints:
+            endpoint.pool.close()
+
+    def _acquire(self, avoid=None):
+        """选出进行中请求最少且未达并发上限的实例，全部满载时等待"""
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                candidates = [e for e in self.endpoints if e.available(now)]
+                if not candidates:
+                    # 全部被剔除时不能停止标注，选最早到期的实例试探
+                    candidates = [min(self.endpoints, key=lambda e: e.ejected_until)]
+                if avoid is not None and len(candidates) > 1:
+                    # 重试时尽量换一个实例
+                    candidates = [e for e in candidates if e is not avoid] or candidates
+                ready = [e for e in candidates if e.has_capacity()]
+                if ready:
+                    endpoint = min(ready, key=lambda e: (e.load(), e.requests))
+                    endpoint.outstanding += 1
+                    endpoint.requests += 1
+                    return endpoint
+                self.condition.wait(1.0)
+
+    def _release(self, endpoint, ok):
+        with self.condition:
+            endpoint.outstanding -= 1
+            if ok:
+                endpoint.failures = 0
+                endpoint.ejections = 0
+                endpoint.ejected_until = 0.0
+            else:
+                endpoint.errors += 1
+                endpoint.failures += 1
+                # 刚重新加入、还没有成功过的实例再失败一次就立即剔除
+                if (endpoint.failures >= self.eject_after or endpoint.ejections) and len(self.endpoints) > 1:
+                    self._eject(endpoint)
+            self.condition.notify_all()
+
+    def _eject(self, endpoint):
+        # 反复被剔除的实例剔除时间翻倍，最长10倍
+        endpoint.ejections += 1
+        delay = self.eject_seconds * min(10, 2 ** (endpoint.ejections - 1))
+        endpoint.ejected_until = time.monotonic() + delay
+        endpoint.failures = 0
+        print(f"标注服务 {endpoint.url} 连续失败，暂停使用{delay:g}秒")
+
+    def _health_loop(self, interval):
+        """定期探测被剔除的实例，能正常响应HTTP的立即重新加入"""
+        while not self.closed.wait(interval):
+            now = time.monotonic()
+            with self.condition:
+                ejected = [e for e in self.endpoints if not e.available(now)]
+            for endpoint in ejected:
+                if self._probe(endpoint):
+                    with self.condition:
+                        endpoint.ejected_until = 0.0
+                        self.condition.notify_all()
+                    print(f"标注服务 {endpoint.url} 已恢复")
+
+    def _probe(self, endpoint):
+        # 标注接口只接受POST，任何非5xx的HTTP响应都说明服务在运行
+        conn = endpoint.pool._new_connection()
+        try:
+            conn.timeout = min(self.timeout, 5)
+            conn.request('GET', endpoint.pool.path)
+            status = conn.getresponse().status
+            return status < 500
+        except (OSError, http.client.HTTPException):
+            return False
+        finally:
+            conn.close()
+
+    def _post(self, pool, body, content_type):
+        conn, reused = pool.get()
+        try:
+            conn.request('POST', pool.path, body=body, headers={
+                'Content-Type': content_type,
+                'Accept': 'application/json',
+                'Connection': 'keep-alive'
+            })
+            response = conn.getresponse()
+            data = response.read()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if reused:
+                # 服务端关闭了空闲连接，换新连接重发一次，不计入重试次数
+                return self._post(pool, body, content_type)
+            raise
+        except Exception:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            pool.put(conn)
+        return response.status, data
+
+    def tag_image(self, data, filename, mime_type='application/octet-stream'):
+        """上传图片字节并返回标签字符串，失败时抛出TaggerError"""
+        body, content_type = encode_multipart('file', filename, data, mime_type)
+        last_error = None
+        status = None
+        endpoint = None
+        for attempt in range(1, self.retries + 2):
+            started = self.limiter.acquire() if self.limiter is not None else None
+            endpoint = self._acquire(avoid=endpoint)
+            ok = False
+            try:
+                status, payload = self._post(endpoint.pool, body, content_type)
+                if status == 200:
+                    result = parse_response(payload)
+                    ok = True
+                    return result
+                last_error = f"HTTP {status}: {payload[:200].decode('utf-8', 'replace')}"
+                # 4xx是请求本身的问题，不算实例故障
+                ok = status < 500 and status != 429
+                if ok:
+                    # 客户端错误重试也不会成功
+                    break
+            except TaggerError as e:
+                ok = True
+                e.url, e.status, e.attempts = endpoint.url, status, attempt
+                raise
+            except (OSError, http.client.HTTPException) as e:
+                status = None
+                last_error = f"{type(e).__name__}: {str(e)}"
+            finally:
+                self._release(endpoint, ok)
+                if self.limiter is not None:
+                    self.limiter.release(started, ok)
+            if attempt <= self.retries:
+                metrics.count('retries')
+                time.sleep(self.backoff * (2 ** (attempt - 1)) * (1 + random.random() * 0.5))
+        raise TaggerError(last_error, url=endpoint.url, status=status, attempts=attempt)
+
+    def stats(self):
+        with self.condition:
+            now = time.monotonic()
+            return [{
+                'url': e.url,
+                'requests': e.requests,
+                'errors': e.errors,
+                'outstanding': e.outstanding,
+                'ejected': not e.available(now)
+            } for e in self.endpoints]
+
+
+def parse_urls(value):
+    """解析api_url配置，多个实例用分号或换行分隔"""
+    return [url.strip() for url in value.replace('\n', ';').split(';') if url.strip()]
+
+
+def format_stats(stats):
+    return '；'.join(
+        f"{s['url']} 请求{s['requests']}次、失败{s['errors']}次" + ("（已剔除）" if s['ejected'] else '')
+        for s in stats
+    )
\ No newline at end of file
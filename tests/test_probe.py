@@ -0,0 +1,210 @@
+import os
+import random
+import struct
+import tempfile
+import unittest
+
+import probe
+
+
+# ---------- 构造最小的容器头 ----------
+
+def box(kind, body):
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def make_mp4(width=1920, height=1080, timescale=1000, length=10000, frames=300, rotate=False):
+    if rotate:
+        matrix = (0, 0x10000, 0, -0x10000, 0, 0, 0, 0, 0x40000000)
+    else:
+        matrix = (0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    tkhd = box(b'tkhd', bytes(40) + struct.pack('>9i', *matrix) + struct.pack('>II', width << 16, height << 16))
+    mdhd = box(b'mdhd', bytes(12) + struct.pack('>II', timescale, length) + bytes(4))
+    hdlr = box(b'hdlr', bytes(8) + b'vide' + bytes(12) + b'\x00')
+    stts = box(b'stts', bytes(4) + struct.pack('>III', 1, frames, length // frames))
+    minf = box(b'minf', box(b'stbl', stts))
+    trak = box(b'trak', tkhd + box(b'mdia', mdhd + hdlr + minf))
+    return box(b'ftyp', b'isom' + bytes(4)) + box(b'moov', trak) + box(b'mdat', bytes(16))
+
+
+def make_avi(width=640, height=480, usec_per_frame=40000, frames=250):
+    avih = b'avih' + struct.pack('<I', 56) + struct.pack(
+        '<14I', usec_per_frame, 0, 0, 0, frames, 0, 1, 0, width, height, 0, 0, 0, 0
+    )
+    hdrl = b'LIST' + struct.pack('<I', 4 + len(avih)) + b'hdrl' + avih
+    return b'RIFF' + struct.pack('<I', 4 + len(hdrl)) + b'AVI ' + hdrl
+
+
+def make_gif(width=320, height=240, delays=(10, 20, 30)):
+    data = b'GIF89a' + struct.pack('<HHBBB', width, height, 0x80, 0, 0) + bytes(6)
+    for delay in delays:
+        data += b'\x21\xf9\x04\x00' + struct.pack('<H', delay) + b'\x00\x00'
+        data += b'\x2c' + struct.pack('<HHHHB', 0, 0, width, height, 0)
+        data += b'\x02\x02\x4c\x01\x00'
+    return data + b'\x3b'
+
+
+def amf_string(value):
+    value = value.encode('utf-8')
+    return struct.pack('>H', len(value)) + value
+
+
+def make_flv(meta=None):
+    if meta is None:
+        meta = {'width': 1280.0, 'height': 720.0, 'duration': 12.5, 'framerate': 25.0}
+    body = b'\x02' + amf_string('onMetaData') + b'\x08' + struct.pack('>I', len(meta))
+    for key, value in meta.items():
+        body += amf_string(key) + b'\x00' + struct.pack('>d', value)
+    body += b'\x00\x00\x09'
+    tag = b'\x12' + len(body).to_bytes(3, 'big') + bytes(7) + body + struct.pack('>I', 11 + len(body))
+    return b'FLV\x01\x05' + struct.pack('>I', 9) + bytes(4) + tag
+
+
+def element(element_id, body):
+    # 长度统一用8字节的EBML变长整数
+    return element_id + b'\x01' + len(body).to_bytes(7, 'big') + body
+
+
+def make_matroska(width=854, height=480, duration_ms=5000.0, frame_ns=33333333):
+    info = element(b'\x2a\xd7\xb1', (1000000).to_bytes(3, 'big')) + element(b'\x44\x89', struct.pack('>d', duration_ms))
+    video = element(b'\xb0', width.to_bytes(2, 'big')) + element(b'\xba', height.to_bytes(2, 'big'))
+    entry = element(b'\x83', b'\x01') + element(b'\x23\xe3\x83', frame_ns.to_bytes(4, 'big')) + element(b'\xe0', video)
+    segment = element(b'\x15\x49\xa9\x66', info) + element(b'\x16\x54\xae\x6b', element(b'\xae', entry))
+    segment += element(b'\x1f\x43\xb6\x75', bytes(8))
+    return element(b'\x1a\x45\xdf\xa3', element(b'\x42\x82', b'webm')) + element(b'\x18\x53\x80\x67', segment)
+
+
+class ProbeTestCase(unittest.TestCase):
+    """把构造的字节写入临时文件后调用probe.probe"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def probe(self, data, name='video.bin'):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return probe.probe(path)
+
+    def assert_robust(self, data):
+        """截断到任意长度或随机改写字节后都不抛出异常，结果为None或宽高有效的VideoInfo"""
+        samples = [data[:n] for n in range(len(data))]
+        rng = random.Random(len(data))
+        for _ in range(200):
+            corrupt = bytearray(data)
+            for _ in range(rng.randint(1, 4)):
+                corrupt[rng.randrange(len(corrupt))] = rng.randrange(256)
+            samples.append(bytes(corrupt))
+        for sample in samples:
+            info = self.probe(sample)
+            if info is not None:
+                self.assertGreater(info.width, 0)
+                self.assertGreater(info.height, 0)
+
+
+class Mp4Test(ProbeTestCase):
+
+    def test_header(self):
+        info = self.probe(make_mp4())
+        self.assertEqual((info.width, info.height, info.frame_count), (1920, 1080, 300))
+        self.assertAlmostEqual(info.duration, 10.0)
+        self.assertAlmostEqual(info.fps, 30.0)
+
+    def test_rotated(self):
+        info = self.probe(make_mp4(rotate=True))
+        self.assertEqual((info.width, info.height), (1080, 1920))
+
+    def test_without_moov(self):
+        self.assertIsNone(self.probe(box(b'ftyp', b'isom' + bytes(4)) + box(b'mdat', bytes(16))))
+
+    def test_huge_stts_count(self):
+        # 条目数远大于box本身时只统计实际存在的条目
+        data = make_mp4()
+        pos = data.index(b'stts') + 8
+        data = data[:pos] + struct.pack('>I', 0x7fffffff) + data[pos + 4:]
+        self.assertEqual(self.probe(data).frame_count, 300)
+
+    def test_truncated_and_corrupt(self):
+        self.assert_robust(make_mp4())
+
+
+class AviTest(ProbeTestCase):
+
+    def test_header(self):
+        info = self.probe(make_avi())
+        self.assertEqual((info.width, info.height, info.frame_count), (640, 480, 250))
+        self.assertAlmostEqual(info.fps, 25.0)
+        self.assertAlmostEqual(info.duration, 10.0)
+
+    def test_without_avih(self):
+        self.assertIsNone(self.probe(make_avi().replace(b'avih', b'junk')))
+
+    def test_truncated_and_corrupt(self):
+        self.assert_robust(make_avi())
+
+
+class GifTest(ProbeTestCase):
+
+    def test_header(self):
+        info = self.probe(make_gif())
+        self.assertEqual((info.width, info.height, info.frame_count), (320, 240, 3))
+        self.assertAlmostEqual(info.duration, 0.6)
+
+    def test_zero_delay(self):
+        # 0延迟的帧按0.1秒播放
+        info = self.probe(make_gif(delays=(0, 0)))
+        self.assertAlmostEqual(info.duration, 0.2)
+
+    def test_truncated_and_corrupt(self):
+        self.assert_robust(make_gif())
+
+
+class FlvTest(ProbeTestCase):
+
+    def test_header(self):
+        info = self.probe(make_flv())
+        self.assertEqual((info.width, info.height, info.frame_count), (1280, 720, 312))
+        self.assertAlmostEqual(info.duration, 12.5)
+        self.assertAlmostEqual(info.fps, 25.0)
+
+    def test_without_size(self):
+        self.assertIsNone(self.probe(make_flv({'duration': 3.0})))
+
+    def test_metadata_not_object(self):
+        data = make_flv()
+        pos = data.index(b'onMetaData') + len(b'onMetaData')
+        data = data[:pos] + b'\x00' + struct.pack('>d', 1.0) + bytes(32)
+        self.assertIsNone(self.probe(data))
+
+    def test_truncated_and_corrupt(self):
+        self.assert_robust(make_flv())
+
+
+class MatroskaTest(ProbeTestCase):
+
+    def test_header(self):
+        info = self.probe(make_matroska())
+        self.assertEqual((info.width, info.height, info.frame_count), (854, 480, 150))
+        self.assertAlmostEqual(info.duration, 5.0)
+        self.assertAlmostEqual(info.fps, 30.0, places=3)
+
+    def test_invalid_vint(self):
+        self.assertIsNone(self.probe(b'\x1a\x45\xdf\xa3' + bytes(16)))
+
+    def test_truncated_and_corrupt(self):
+        self.assert_robust(make_matroska())
+
+
+class UnknownTest(ProbeTestCase):
+
+    def test_unknown_and_empty(self):
+        self.assertIsNone(self.probe(b'not a video at all'))
+        self.assertIsNone(self.probe(b''))
+
+    def test_missing_file(self):
+        self.assertIsNone(probe.probe(os.path.join(self.tmp.name, 'missing.mp4')))
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
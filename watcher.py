@@ -0,0 +1,276 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import configparser
+
+import libindex
+
+# inotify常量（见 <sys/inotify.h>）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+# 失败条目的重试间隔，每次失败翻倍
+RETRY_SECONDS = 60
+MAX_RETRY_SECONDS = 6 * 3600
+
+
+def load_config():
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+    return {
+        'backend': config.get('watch', 'backend', fallback='auto').strip().lower(),
+        'debounce': config.getfloat('watch', 'debounce', fallback=3.0),
+        'poll_interval': config.getfloat('watch', 'poll_interval', fallback=30.0),
+        'initial_scan': config.getboolean('watch', 'initial_scan', fallback=True)
+    }
+
+
+class InotifyUnavailable(Exception):
+    """当前系统不支持inotify或监视数量超出限制，需要改用轮询"""
+
+
+class InotifyWatcher:
+    """基于inotify监视素材库目录，返回metadata.json发生变化的条目文件夹"""
+
+    def __init__(self, roots):
+        if not sys.platform.startswith('linux'):
+            raise InotifyUnavailable("非Linux系统")
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise InotifyUnavailable("找不到libc")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise InotifyUnavailable(os.strerror(ctypes.get_errno()))
+        self.watches = {}
+        try:
+            for root in roots:
+                self._watch_tree(root)
+        except InotifyUnavailable:
+            self.close()
+            raise
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def _add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise InotifyUnavailable("监视数量超出fs.inotify.max_user_watches限制")
+            if err != errno.ENOENT:
+                print(f"无法监视 {path}: {os.strerror(err)}")
+            return
+        self.watches[wd] = path
+
+    def _watch_tree(self, root):
+        """监视目录及其全部子目录，返回其中已有metadata.json的文件夹"""
+        found = []
+        for dir_path, dirs, files in os.walk(root):
+            self._add_watch(dir_path)
+            if 'metadata.json' in files:
+                found.append(dir_path)
+        return found
+
+    def read(self, timeout):
+        """等待事件，timeout为None时一直阻塞；返回(变化的文件夹集合, 是否溢出)"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set(), False
+        data = os.read(self.fd, 256 * 1024)
+        changed = set()
+        overflow = False
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            dir_path = self.watches.get(wd)
+            if dir_path is None:
+                continue
+            if mask & (IN_IGNORED | IN_DELETE_SELF):
+                self.watches.pop(wd, None)
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # 新导入的条目文件夹，可能在加上监视前已写好metadata.json
+                changed.update(self._watch_tree(os.path.join(dir_path, name)))
+            elif name == 'metadata.json':
+                changed.add(dir_path)
+        return changed, overflow
+
+
+class LibraryWatcher:
+    """监视模式：发现新导入或变化的条目，去抖后只把这些条目送入流水线
+
+    优先使用inotify，空闲时阻塞等待不占用CPU；不可用时按poll_interval轮询增量索引。
+    """
+
+    def __init__(self, pipeline, config=None):
+        self.pipeline = pipeline
+        self.config = config or load_config()
+        self.image_exts = {ext.strip().lower() for ext in pipeline.photo_config['image_exts']}
+        self.video_exts = set(pipeline.video_config['video_exts'])
+        self.roots = [p for p in pipeline.photo_config['paths'] + pipeline.video_config['search_paths'] if p]
+        self.roots = list(dict.fromkeys(self.roots))
+        self.pending = {}
+        # 失败后等待重试的文件夹 -> 可以重试的时间（time.monotonic()）
+        self.retries = {}
+
+    def retry_time(self, media_path):
+        """条目在本次运行中失败过时返回可以重试的时间，否则返回None"""
+        with self.pipeline.lock:
+            failure = self.pipeline.failures.get(media_path)
+        if failure is None:
+            return None
+        count, failed_at = failure
+        return failed_at + min(MAX_RETRY_SECONDS, RETRY_SECONDS * 2 ** (count - 1))
+
+    def submit_folder(self, folder):
+        """读取条目的metadata.json，未标注的图片或视频送入流水线"""
+        entry = libindex.read_metadata(os.path.join(folder, 'metadata.json'))
+        if entry is None:
+            return False
+        name, ext, tagged = entry
+        ext_lower = ext.lower()
+        if tagged:
+            return False
+        if ext_lower in self.video_exts:
+            media_path = os.path.join(folder, f"{name}.{ext_lower}")
+        elif ext_lower in self.image_exts:
+            media_path = os.path.join(folder, f"{name}.{ext}")
+        else:
+            return False
+        # 失败的条目写入的metadata.json也会触发变化，按退避间隔重试，不在每次变化时重试
+        retry = self.retry_time(media_path)
+        if retry is not None and retry > time.monotonic():
+            self.retries[folder] = retry
+            return False
+        return self.pipeline.submit(media_path)
+
+    def flush(self, now, force=False):
+        """处理已经稳定debounce秒的文件夹和到了重试时间的失败条目，返回距离下一次需要处理还需等待的秒数"""
+        wait = None
+        for folder, retry in list(self.retries.items()):
+            remaining = retry - now
+            if remaining <= 0:
+                del self.retries[folder]
+                self.pending.setdefault(folder, now - self.config['debounce'])
+            else:
+                wait = remaining if wait is None else min(wait, remaining)
+        for folder, last in list(self.pending.items()):
+            remaining = last + self.config['debounce'] - now
+            if remaining <= 0 or force:
+                del self.pending[folder]
+                if self.submit_folder(folder):
+                    print(f"发现新条目: {folder}")
+            else:
+                wait = remaining if wait is None else min(wait, remaining)
+        return wait
+
+    def run(self):
+        backend = self.config['backend']
+        if backend in ('auto', 'inotify'):
+            try:
+                watcher = InotifyWatcher(self.roots)
+            except InotifyUnavailable as e:
+                if backend == 'inotify':
+                    raise
+                print(f"inotify不可用（{str(e)}），改用轮询")
+            else:
+                print(f"正在用inotify监视{len(watcher.watches)}个目录，按Ctrl+C退出")
+                try:
+                    self._run_inotify(watcher)
+                finally:
+                    watcher.close()
+                return
+        print(f"正在每{self.config['poll_interval']:g}秒轮询素材库，按Ctrl+C退出")
+        self._run_polling()
+
+    def _run_inotify(self, watcher):
+        timeout = None
+        while True:
+            changed, overflow = watcher.read(timeout)
+            now = time.monotonic()
+            for folder in changed:
+                # Eagle导入时会多次写入metadata.json，以最后一次为准
+                self.pending[folder] = now
+            if overflow:
+                print("inotify事件队列溢出，重新扫描素材库")
+                self.pipeline.discover()
+            timeout = self.flush(now)
+
+    def _run_polling(self):
+        """每轮只处理索引中新增或metadata.json有变化的未标注条目
+
+        initial_scan为false时第一轮只建立索引，不处理已有的条目。
+        """
+        index = libindex.LibraryIndex(libindex.load_config()['db_path'])
+        exts = self.image_exts | self.video_exts
+        # 变化后仍在被写入、等下一轮再处理的文件夹
+        unsettled = set()
+        first = True
+        try:
+            while True:
+                changed = set()
+                entries, stats = index.scan(self.roots, exts, changed)
+                if first and not self.config['initial_scan']:
+                    changed.clear()
+                first = False
+                untagged = {entry.folder for entry in entries}
+                unsettled &= untagged
+                now = time.time()
+                for folder in (changed | unsettled) & untagged:
+                    unsettled.discard(folder)
+                    try:
+                        mtime = os.stat(os.path.join(folder, 'metadata.json')).st_mtime
+                    except OSError:
+                        continue
+                    # metadata.json最近仍在被写入时等下一轮
+                    if now - mtime >= self.config['debounce']:
+                        self.pending[folder] = 0
+                    else:
+                        unsettled.add(folder)
+                self.flush(time.monotonic(), force=True)
+                time.sleep(self.config['poll_interval'])
+        finally:
+            index.close()
+
+
+def main():
+    import pipeline
+    config = load_config()
+    runner = pipeline.Pipeline()
+    try:
+        # 先继续上次中断的条目，再按需扫描一次已有的未标注条目
+        runner.start()
+        if config['initial_scan']:
+            runner.discover()
+        LibraryWatcher(runner, config).run()
+    except KeyboardInterrupt:
+        print("\n收到退出信号，等待进行中的条目处理完成...")
+    finally:
+        runner.finish()
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file